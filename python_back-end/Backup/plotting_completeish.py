@@ -134,7 +134,7 @@ def blob2map(display = False):
     all_roads = []
     for blob in range(len(blobData["cityShapes"])):
         borderArray = np.array(blobData["cityShapes"][blob]["outerPolygon"])
-        junctions, roads = Blob2Graph(borderArray, 10)
+        junctions, roads = Blob2Graph(borderArray, 10, dense=True)
         road_data = {
             'Junctions': junctions,
             'Roads': roads
@@ -140,7 +140,7 @@ def add_blobs(ax, blobData):
         border_patch = Polygon(border_coords, color='black', alpha=0.5,hatch='\\')
         ax.add_patch(border_patch)
 
-        nodes, edges = Blob2Graph(borderArray,10)
+        nodes, edges = Blob2Graph(borderArray,10, dense=True)
         add_roads(ax, {'Junctions':nodes,'Roads':edges})
 
 
@@ -4,11 +4,14 @@
 #edges as roads
 
 import numpy as np
-import matplotlib.pyplot as plt
-from shapely.geometry import Point, Polygon, LineString
-from scipy.sparse import dok_matrix
-import json
-import networkx as nx
+import shapely
+from shapely.geometry import Polygon
+from scipy.sparse import coo_matrix, triu
+from scanline import boundary_junctions
+
+# bump whenever the grid Blob2Graph returns for a given outline and pitch
+# changes, so cached grids from older versions are not reused
+GRID_VERSION = 2
 
 #%% example region definition (circle)
 if __name__ == '__main__':
@@ -16,11 +19,13 @@ if __name__ == '__main__':
     r = 1
     borderArray = np.array([r*np.cos(theta), r*np.sin(theta)]).T
     #  import blob data
-    with open('c://Users//Basil//Desktop//Uni//Year_4//Hackathon//ecocityology//exportData(3).txt', "r") as f:
-        blobData = json.load(f)
+    import sys
+    from itertools import islice
+    from city_io import iter_city_shapes
+    shapes = iter_city_shapes(sys.argv[1] if len(sys.argv) > 1 else 'exportData(3).txt')
         
     #example border Array:
-    borderArray = np.array(blobData["cityShapes"][1]["outerPolygon"])
+    borderArray = next(islice(shapes, 1, None))["outerPolygon"]
     polygon = Polygon(borderArray)
     #target grid pitch
     L = 10
@@ -34,150 +39,102 @@ def getGraph(borderArray):
     # make wider grid
     
 #%%
-def Blob2Graph(borderArray, L):
-
+def points_inside(polygon, points):
+    """
+    Returns a boolean mask of which points lie strictly inside the polygon
+    (same result as polygon.contains(Point(p)) for each point), classified
+    in a single vectorised call against the prepared geometry.
+    """
+    shapely.prepare(polygon)
+    return shapely.contains_xy(polygon, points[:, 0], points[:, 1])
+
+def grid_node_ids(isInside, nRows, nCols):
+    """
+    Returns the (nRows, nCols) map from grid position to the index of that
+    point among the inside points, -1 for points outside the polygon.
+    """
+    node_id = np.full(nRows * nCols, -1)
+    node_id[isInside] = np.arange(np.count_nonzero(isInside))
+    return node_id.reshape(nRows, nCols)
+
+def lattice_edges(node_id):
+    """
+    Returns the (i, j) index pairs of the 4-neighbour lattice edges between
+    grid points that are both inside the polygon.
+    """
+    inside = node_id >= 0
+    # right neighbours
+    right = inside[:, :-1] & inside[:, 1:]
+    # top neighbours
+    up = inside[:-1, :] & inside[1:, :]
+    i = np.concatenate([node_id[:, :-1][right], node_id[:-1, :][up]])
+    j = np.concatenate([node_id[:, 1:][right], node_id[1:, :][up]])
+    return i, j
+
+def Blob2Graph(borderArray, L, dense=False):
+    """
+    Builds a road grid of pitch ~L inside the polygon borderArray.
+    Returns the junction coordinates and a symmetric scipy.sparse CSR
+    adjacency matrix, or a dense numpy array if dense is True.
+    """
     polygon = Polygon(borderArray)
 
     # Generate grid
     x_min, y_min, x_max, y_max = polygon.bounds
-    nCols  = np.round((x_max - x_min)/L).astype(int) 
-    nRows = np.round((y_max - y_min)/L).astype(int)
+    # at least one grid line strictly between the bounds on each axis, so
+    # blobs narrower than the pitch still get a road through them
+    nCols  = max(np.round((x_max - x_min)/L).astype(int), 3)
+    nRows = max(np.round((y_max - y_min)/L).astype(int), 3)
     x_values = np.linspace(x_min, x_max, nCols)  # Grid resolution
     y_values = np.linspace(y_min, y_max, nRows)
     xx, yy = np.meshgrid(x_values, y_values)
     grid_points = np.vstack([xx.ravel(), yy.ravel()]).T
 
-    num_nodes = nRows * nCols
-
-    # Create sparse adjacency matrix
-    adj_matrix = np.zeros((num_nodes, num_nodes), dtype=int)
-
-    for i in range(nRows):
-        for j in range(nCols):
-            index = i * nCols + j  # Convert 2D index to 1D
-
-            # Right neighbor
-            if j + 1 < nCols:
-                adj_matrix[index, index + 1] = 1
-                adj_matrix[index + 1, index] = 1  # Ensure symmetry
-
-            # Bottom neighbor
-            if i + 1 < nRows:
-                adj_matrix[index, index + nCols] = 1
-                adj_matrix[index + nCols, index] = 1  # Ensure symmetry
     # Filter points inside the polygon
-    isInside = np.array([polygon.contains(Point(p)) for p in grid_points])
+    isInside = points_inside(polygon, grid_points)
     inside_points = grid_points[isInside]
-    #remove rows and columns from adjacency matrix according to points outside polygon
-    adj_matrix = adj_matrix[isInside]
-    adj_matrix = adj_matrix[:,isInside]
-    # Add intersection nodes at the polygon boundary
-    intersection_nodes = []
-    additional_edges = []
-    row = np.zeros(adj_matrix.shape[0])
-    for x in x_values:
-        line = LineString([(x, y_min), (x, y_max)])
-        intersections = polygon.intersection(line)
-
-        if intersections.geom_type == 'LineString':
-            (x0,y0,x1,y1) = intersections.bounds
-            intersection_nodes.append((x0, y0))
-            intersection_nodes.append((x1, y1))
-            # find inside edge indices
-            insideX = np.all(np.array([inside_points[:,1] > y0, inside_points[:,1] < y1, inside_points[:, 0] == x]), axis=0)
-            idxEdge = np.where(insideX)
-            
-            minY =idxEdge[0][0]
-            maxY = idxEdge[0][-1]
-            # #add edges to adjacency matrix
-            row1 = row.copy()
-            row1[minY] = 1
-            additional_edges.append(row1)
-            row2 = row.copy()
-            row2[maxY] = 1
-            additional_edges.append(row2)
-
-
-
-        elif intersections.geom_type == 'MultiLineString':
-            for line in intersections.geoms:
-                (x0,y0,x1,y1) = line.bounds
-                intersection_nodes.append((x0, y0))
-                intersection_nodes.append((x1, y1))
-                insideX = np.all(np.array([inside_points[:,1] > y0, inside_points[:,1] < y1, inside_points[:, 0] == x]), axis=0)
-                idxEdge = np.where(insideX)
-                
-                minY =idxEdge[0][0]
-                maxY = idxEdge[0][-1]
-                # #add edges to adjacency matrix
-                row1 = row.copy()
-                row1[minY] = 1
-                additional_edges.append(row1)
-                row2 = row.copy()
-                row2[maxY] = 1
-                additional_edges.append(row2)
-
-                
-
-    for y in y_values:
-        line = LineString([(x_min, y), (x_max, y)])
-        intersections = polygon.intersection(line)
-        
-        if intersections.geom_type == 'LineString':
-            (x0,y0,x1,y1) = intersections.bounds
-            intersection_nodes.append((x0, y0))
-            intersection_nodes.append((x1, y1))
-            # find inside edge indices
-            insideY = np.all(np.array([inside_points[:,0] > x0, inside_points[:,0] < x1, inside_points[:, 1] == y]), axis=0)
-            idxEdge = np.where(insideY)
-            minX =idxEdge[0][0]
-            maxX = idxEdge[0][-1]
-            # #add edges to adjacency matrix
-            row1 = row.copy()
-            row1[minX] = 1
-            additional_edges.append(row1)
-            row2 = row.copy()
-            row2[maxX] = 1
-            additional_edges.append(row2)
-        elif intersections.geom_type == 'MultiLineString':
-            for line in intersections.geoms:
-                (x0,y0,x1,y1) = intersections.bounds
-                intersection_nodes.append((x0, y0))
-                intersection_nodes.append((x1, y1))
-                # find inside edge indices
-                insideY = np.all(np.array([inside_points[:,0] > x0, inside_points[:,0] < x1, inside_points[:, 1] == y]), axis=0)
-                idxEdge = np.where(insideY)
-                minX =idxEdge[0][0]
-                maxX = idxEdge[0][-1]
-                # #add edges to adjacency matrix
-                row1 = row.copy()
-                row1[minX] = 1
-                additional_edges.append(row1)
-                row2 = row.copy()
-                row2[maxX] = 1
-                additional_edges.append(row2)
-
-
-    intersection_nodes = np.array(intersection_nodes)
+    node_id = grid_node_ids(isInside, nRows, nCols)
+    # lattice edges between neighbouring inside points
+    edge_i, edge_j = lattice_edges(node_id)
+    # Add intersection nodes where the grid lines cross the polygon boundary
+    intersection_nodes, attach = boundary_junctions(polygon, x_values, y_values, node_id)
+
     all_nodes = np.vstack([inside_points, intersection_nodes])  # Combine valid grid points and intersections
-    # combine adjacency matrix with additional edges
-    addMat = np.vstack(additional_edges)
-    adj_matrix = np.hstack([np.vstack([adj_matrix, addMat]), np.vstack([addMat.T, np.zeros((addMat.shape[0], addMat.shape[0]))])])
+    # boundary node k is joined to the inside point attach[k]
+    boundary_ids = len(inside_points) + np.arange(len(intersection_nodes))
+    edge_i = np.concatenate([edge_i, attach])
+    edge_j = np.concatenate([edge_j, boundary_ids])
+    adj_matrix = edges_to_adjacency(edge_i, edge_j, len(all_nodes))
+    if dense:
+        adj_matrix = adj_matrix.toarray()
 
     return all_nodes, adj_matrix
 
+def edges_to_adjacency(edge_i, edge_j, num_nodes):
+    """
+    Builds a symmetric 0/1 CSR adjacency matrix from undirected edge lists.
+    """
+    rows = np.concatenate([edge_i, edge_j])
+    cols = np.concatenate([edge_j, edge_i])
+    data = np.ones(len(rows), dtype=int)
+    adj_matrix = coo_matrix((data, (rows, cols)), shape=(num_nodes, num_nodes)).tocsr()
+    # duplicate edges sum on conversion, clamp back to 0/1
+    adj_matrix.data[:] = 1
+    return adj_matrix
+
 
 #%% Plot results
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    all_nodes, adj_matrix = Blob2Graph(borderArray, L)
     plt.figure(figsize=(6,6))
     plt.plot(*polygon.exterior.xy, 'k-', label='Polygon Boundary')
     #plt.scatter(inside_points[:, 0], inside_points[:, 1], s=5, color='red', label='Grid Points')
     #plt.scatter(intersection_nodes[:, 0], intersection_nodes[:, 1], s=20, color='blue', label='Intersection Nodes')
     # add edges
-    for i in range(adj_matrix.shape[0]):
-        for j in range(i, adj_matrix.shape[1]):
-            if adj_matrix[i,j] == 1:
-                plt.plot([all_nodes[i,0], all_nodes[j,0]], [all_nodes[i,1], all_nodes[j,1]], 'g-')
+    edges = np.column_stack(triu(adj_matrix).nonzero())
+    plt.gca().add_collection(LineCollection(all_nodes[edges], colors='g'))
 
     plt.legend()
     plt.show()
@@ -0,0 +1,180 @@
+# benchmark
+# Times the grid, road and placement hot paths on synthetic blobs and writes
+# the results to a JSON file so runs can be compared across commits.
+#
+#   python benchmark.py [--quick] [--output bench.json]
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from Blob2Graph import Blob2Graph
+import citygen
+
+
+def circle_blob(radius, n=100, centre=(0, 0)):
+    """
+    Regular n-gon approximating a circle.
+    """
+    theta = np.linspace(0, 2*np.pi, n, endpoint=False)
+    return np.c_[centre[0] + radius*np.cos(theta), centre[1] + radius*np.sin(theta)]
+
+def star_blob(radius, points=7, inner=0.45, centre=(0, 0)):
+    """
+    Concave star with `points` spikes, inner radius inner * radius.
+    """
+    theta = np.linspace(0, 2*np.pi, 2*points, endpoint=False)
+    r = np.where(np.arange(2*points) % 2, inner*radius, radius)
+    return np.c_[centre[0] + r*np.cos(theta), centre[1] + r*np.sin(theta)]
+
+def lobed_blob(radius, lobes=3, n=200, centre=(0, 0)):
+    """
+    Smooth multi-lobed outline, r = radius * (1 + 0.35 sin(lobes * theta)).
+    """
+    theta = np.linspace(0, 2*np.pi, n, endpoint=False)
+    r = radius*(1 + 0.35*np.sin(lobes*theta))
+    return np.c_[centre[0] + r*np.cos(theta), centre[1] + r*np.sin(theta)]
+
+SHAPES = {'circle': circle_blob, 'star': star_blob, 'lobed': lobed_blob}
+
+
+def measure(func, repeat):
+    """
+    Best wall time of `repeat` calls, the peak traced (Python-level)
+    allocation of one extra call and the peak RSS of a forked child making
+    one more (see case_rss_mb). Returns (result, seconds, peak_traced_mb,
+    peak_rss_mb).
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak / 2**20, case_rss_mb(func)
+
+def case_rss_mb(func):
+    """
+    ru_maxrss of a forked child that calls func once: the benchmark
+    process's footprint at fork time plus whatever func adds, including
+    allocations tracemalloc does not see (GEOS, BLAS). None where fork is
+    unavailable.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('fork')
+    receive, send = context.Pipe(duplex=False)
+
+    def child():
+        func()
+        send.send(max_rss_mb())
+
+    process = context.Process(target=child)
+    process.start()
+    process.join()
+    return receive.recv() if receive.poll() else None
+
+def max_rss_mb():
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def bench_grid(sizes, pitches, repeat):
+    """
+    Blob2Graph over every shape, radius and pitch.
+    """
+    rows = []
+    for shape, make in SHAPES.items():
+        for radius in sizes:
+            border = make(radius)
+            for L in pitches:
+                (nodes, adj), seconds, peak, rss = measure(lambda: Blob2Graph(border, L), repeat)
+                rows.append({'stage': 'grid', 'shape': shape, 'radius': radius, 'pitch': L,
+                             'seconds': seconds, 'peak_traced_mb': peak, 'peak_rss_mb': rss, 'nodes': len(nodes),
+                             'edges': adj.nnz // 2, 'nodes_per_second': len(nodes) / seconds})
+    return rows
+
+def bench_roads(sizes, repeat):
+    """
+    Road union (as built for placement) over every shape and radius, on
+    grids at the Residential density.
+    """
+    rows = []
+    for shape, make in SHAPES.items():
+        for radius in sizes:
+            blob = {'id': 'Residential', 'outerPolygon': make(radius)}
+            road_data = citygen.generate_blob_grid(blob)
+            pitch = road_data['Pitch']
+            junctions = road_data['Junctions']
+            edges = citygen.road_edges(road_data)
+            _, seconds, peak, rss = measure(lambda: citygen.road_union(junctions, edges), repeat)
+            rows.append({'stage': 'roads', 'shape': shape, 'radius': radius, 'pitch': pitch,
+                         'seconds': seconds, 'peak_traced_mb': peak, 'peak_rss_mb': rss, 'edges': len(edges),
+                         'edges_per_second': len(edges) / seconds})
+    return rows
+
+def bench_placement(radius, fills, modes, repeat):
+    """
+    add_req_buildings on a lobed blob over a range of fill targets.
+    """
+    rows = []
+    blob = {'id': 'Commercial', 'outerPolygon': lobed_blob(radius)}
+    road_data = citygen.generate_blob_grid(blob)
+    roads = citygen.road_union(road_data['Junctions'], citygen.road_edges(road_data))
+    saved = citygen.region_info['Commercial']['fill_attempts']
+    try:
+        for mode in modes:
+            for fill in fills:
+                citygen.region_info['Commercial']['fill_attempts'] = fill
+                run = lambda: citygen.add_req_buildings(blob, roads, mode, np.random.default_rng(0))
+                buildings, seconds, peak, rss = measure(run, repeat)
+                rows.append({'stage': 'placement', 'mode': mode, 'radius': radius, 'fill_attempts': fill,
+                             'seconds': seconds, 'peak_traced_mb': peak, 'peak_rss_mb': rss, 'buildings': len(buildings),
+                             'buildings_per_second': len(buildings) / seconds})
+    finally:
+        citygen.region_info['Commercial']['fill_attempts'] = saved
+    return rows
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(quick=False):
+    if quick:
+        sizes, pitches, fills, repeat = [50, 150], [5, 10], [100, 500], 1
+    else:
+        sizes, pitches, fills, repeat = [50, 150, 300, 550], [2, 5, 10, 20], [100, 500, 2000, 5000], 3
+    results = []
+    results += bench_grid(sizes, pitches, repeat)
+    results += bench_roads(sizes, repeat)
+    results += bench_placement(max(sizes) / 2, fills, ['uniform', 'raster', 'blocks'], repeat)
+    return {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'process_max_rss_mb': max_rss_mb(), 'results': results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the city generation hot paths.')
+    parser.add_argument('--quick', action='store_true', help='small sweep for a fast check')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+    report = run(args.quick)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    for row in report['results']:
+        rate = next((k for k in row if k.endswith('_per_second')), None)
+        print(row['stage'], row.get('shape', row.get('mode')), row.get('radius'), row.get('pitch', row.get('fill_attempts')),
+              f"{row['seconds']*1000:.1f} ms", f"{row['peak_rss_mb']:.0f} MB RSS" if row['peak_rss_mb'] else '',
+              f"{row[rate]:.0f} {rate}" if rate else '')
+    print(f"process max RSS {report['process_max_rss_mb']:.0f} MB, written to {args.output}")
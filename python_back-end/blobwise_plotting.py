@@ -1,23 +1,17 @@
+# blobwise_plotting
+# Draws a city generated by citygen with matplotlib.
+
 import numpy as np
 import matplotlib.pyplot as plt
-from shapely.geometry import Polygon as ShapelyPolygon, Point, LineString, MultiLineString
-from shapely.ops import unary_union
-from shapely.affinity import rotate
-import json
-from Blob2Graph import Blob2Graph
-
-region_info = {
-    "Residential": {"density": 7, "probabilities": {"residential": 0.8, "commercial": 0.15, "industrial": 0.05}, "fill_attempts": 100},
-    "Town Centre": {"density": 8, "probabilities": {"residential": 0.4, "commercial": 0.5, "industrial": 0.1}, "fill_attempts": 80},
-    "Market": {"density": 10, "probabilities": {"residential": 0.3, "commercial": 0.6, "industrial": 0.1}, "fill_attempts": 70},
-    "Commercial": {"density": 12, "probabilities": {"residential": 0.2, "commercial": 0.7, "industrial": 0.1}, "fill_attempts": 60},
-    "Industrial": {"density": 12, "probabilities": {"residential": 0.1, "commercial": 0.2, "industrial": 0.7}, "fill_attempts": 50}
-}
-building_styles = {
-    "residential": {"colour": "blue", "dimensions": (1, 6)},
-    "industrial": {"colour": "purple", "dimensions": (3, 10)},
-    "commercial": {"colour": "red", "dimensions": (4, 7)},
-}
+from matplotlib.collections import LineCollection, PolyCollection
+from collections import defaultdict
+from shapely.geometry import Polygon as ShapelyPolygon
+from citygen import building_styles, generate_city
+from placement import BuildingStore
+from city_io import iter_city_shapes, write_buildings
+from exclusions import ExclusionMask
+from tiles import write_tile_pyramid
+from metrics import Metrics
 
 
 def add_boundary(ax, side_length):
@@ -30,33 +24,11 @@ def add_boundary(ax, side_length):
     ax.fill(x, y, color="white", alpha=0.5, hatch="x")
     return boundary_polygon
 
-def generate_blob_grid(blob):
+def add_roads(ax, segments):
     """
-    Generates a road grid for an individual blob.
+    Draws every road segment, an (E, 2, 2) array, as one LineCollection.
     """
-    borderArray = np.array(blob["outerPolygon"])
-    density = region_info[blob["id"]]["density"]
-    while True:
-        try:
-            junctions, roads = Blob2Graph(borderArray, density) #np.random.randint(9, 10))  # Vary density
-            break
-        except IndexError:
-            density+=0.1
-            print(f"density:{density}")
-    return {'Junctions': junctions, 'Roads': roads}
-
-def add_roads(ax, road_data):
-    junctions = [Point(coord) for coord in road_data['Junctions']]
-    roads = []
-    for i, j in zip(*np.where(np.array(road_data['Roads']) == 1)):
-        if i < j:
-            road_line = LineString([junctions[i].coords[0], junctions[j].coords[0]])
-            roads.append(road_line)
-    road_network = MultiLineString(roads)
-    for line in road_network.geoms:
-        x, y = line.xy
-        ax.plot(x, y, color="black", linewidth=2)
-    return unary_union(road_network)
+    ax.add_collection(LineCollection(segments, colors="black", linewidths=2))
 
 def add_blobs(ax, blobData):
     blobs = []
@@ -65,66 +37,69 @@ def add_blobs(ax, blobData):
         if not polygon.is_valid:
             polygon = polygon.buffer(0)
         blobs.append(polygon)
-        x, y = polygon.exterior.xy
-        ax.fill(x, y, color="black", alpha=0.5, hatch="\\")
+    rings = [np.asarray(polygon.exterior.coords) for polygon in blobs]
+    ax.add_collection(PolyCollection(rings, facecolors="black", alpha=0.5, hatch="\\"))
     return blobs
 
-def place_building(ax, building_type, blob, filled_space, road_network):
-    color_map = {'residential': 'blue', 'commercial': 'red', 'industrial': 'purple'}
-    color = color_map.get(building_type, 'black')
-    attempts = 0
-    x_bar,y_bar = building_styles[building_type]["dimensions"]
-    while attempts < 50:
-        minx, miny, maxx, maxy = blob.bounds
-        x, y = np.random.uniform(minx, maxx), np.random.uniform(miny, maxy)
-        width, height = np.random.uniform(x_bar,y_bar), np.random.uniform(x_bar,y_bar)
-        rotation = np.random.uniform(0, 90)
-        base_shape = ShapelyPolygon([(0, 0), (width, 0), (width, height), (0, height)])
-        rotated_shape = rotate(base_shape, rotation, origin=(0, 0))
-        building = ShapelyPolygon([(px + x, py + y) for px, py in rotated_shape.exterior.coords])
-        if (blob.contains(building) and 
-            not any(building.intersects(existing) for existing in filled_space) and 
-            not building.intersects(road_network)):
-            filled_space.append(building)
-            x, y = building.exterior.xy
-            ax.fill(x, y, color=color, alpha=0.5)
-            return [building_type, list(zip(x, y))]
-        attempts += 1
-    return None
-
-def add_req_buildings(ax, blob, road_network):
-    building_data = []
-    filled_space = []
-    polyBlob = ShapelyPolygon(blob["outerPolygon"])
-    for _ in range(region_info[blob["id"]]["fill_attempts"]):
-        building_type = np.random.choice(['residential', 'commercial', 'industrial'], p=list(region_info[blob["id"]]["probabilities"].values()))
-        building = place_building(ax, building_type, polyBlob, filled_space, road_network)
-        if building is not None:
-            building_data.append(building)
-    return building_data
+def add_buildings(ax, building_data):
+    """
+    Draws the buildings as one PolyCollection per building type.
+    """
+    rings = defaultdict(list)
+    for building_type, coords in building_data:
+        rings[building_type].append(coords)
+    for building_type, coords in rings.items():
+        ax.add_collection(PolyCollection(coords, facecolors=building_styles[building_type]["colour"], alpha=0.5))
 
-def blob2map(display=False):
-    with open('exportData(3).txt', "r") as f:
-        blobData = json.load(f)
+def render_city(blobData, results, side_length=550):
+    """
+    Draws the blobs, boundary, roads and buildings of a generated city.
+    """
     fig, ax = plt.subplots(figsize=(10, 10))
-    side_length = 550
     ax.set_xlim([0, side_length])
     ax.set_ylim([300, side_length])
     ax.set_aspect('equal')
-    blobs = add_blobs(ax, blobData)
-    city_boundary = add_boundary(ax, side_length)
-    all_buildings = []
-    for blob in blobData["cityShapes"]:
-        if blob["id"][0:4] == "Park": # Don't fill parks with houses
-            break
-        road_data = generate_blob_grid(blob)
-        road_network = add_roads(ax, road_data)
-        buildings = add_req_buildings(ax, blob, road_network)
-        all_buildings.extend(buildings)
-    with open("building_data.json", "w") as f:
-        json.dump(all_buildings, f, indent=4)
+    add_blobs(ax, blobData)
+    add_boundary(ax, side_length)
+    segments = [result['Junctions'][result['Edges']] for result in results]
+    add_roads(ax, np.concatenate(segments) if segments else np.empty((0, 2, 2)))
+    add_buildings(ax, [building for result in results for building in result['Buildings']])
+    return fig, ax
+
+def blob2map(display=False, workers=None, seed=None, output=None, cache=None, buildings_path="building_data.json", source='exportData(3).txt', metrics=None, metrics_path=None, rivers=(), tiles_path=None):
+    """
+    Generates the city from the cityShapes export at source (a path or file
+    object), writes the buildings to buildings_path (.json, .npz
+    or flat binary, see city_io) and optionally saves the rendered map to
+    output (format from the extension, e.g. .png or .svg).
+    Stage times and counters go to metrics (a Metrics, created if None) and
+    are dumped as JSON to metrics_path if given.
+    Roads and buildings avoid parks, blob borders and rivers, given as
+    (centreline, width) pairs. With tiles_path, a tile pyramid for the
+    map viewer is written there as well (see tiles).
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.stage('load'):
+        blobData = {"cityShapes": list(iter_city_shapes(source))}
+    with metrics.stage('exclusions'):
+        exclusions = ExclusionMask.from_city(blobData, rivers)
+    with metrics.stage('generate'):
+        results = generate_city(blobData, workers, seed, cache=cache, metrics=metrics, exclusions=exclusions)
+    with metrics.stage('render'):
+        fig, ax = render_city(blobData, results)
+        if output is not None:
+            fig.savefig(output)
+    with metrics.stage('write'):
+        write_buildings(buildings_path, BuildingStore.concatenate([result['Buildings'] for result in results]))
+        if tiles_path is not None:
+            write_tile_pyramid(tiles_path, results)
+    if metrics_path is not None:
+        metrics.dump(metrics_path)
     if display:
+        print(f"compute: {metrics.stages['generate']:.2f}s, render: {metrics.stages['render']:.2f}s")
         plt.show()
     return
 
-blob2map(True)
\ No newline at end of file
+if __name__ == '__main__':
+    blob2map(True)
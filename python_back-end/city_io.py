@@ -0,0 +1,326 @@
+# city_io
+# Reading and writing generated cities. Buildings can be stored column-wise
+# as a type-code array, a ring-offset array and one flat vertex buffer,
+# either as .npz or as a flat binary file with a small JSON header that
+# loads zero-copy through np.memmap. building_data.json stays available.
+# Whole cities can also be streamed blob by blob as NDJSON lines or as
+# binary chunks appended to one file, and cityShapes exports are read
+# incrementally, one shape at a time.
+
+import json
+import os
+import struct
+import numpy as np
+from shapely.geometry import Polygon
+
+BUILDING_TYPES = ['residential', 'commercial', 'industrial']
+MAGIC = b'ECOC'
+ALIGN = 8
+
+
+def pack_buildings(building_data):
+    """
+    Converts [type, [(x, y), ...]] buildings to columnar arrays:
+    types (n,) uint8 codes into BUILDING_TYPES, offsets (n + 1,) int64 so
+    building k owns vertices[offsets[k]:offsets[k + 1]], and vertices (V, 2)
+    float32. A placement.BuildingStore is packed straight from its arrays.
+    """
+    if hasattr(building_data, 'pack'):
+        return building_data.pack()
+    types = np.array([BUILDING_TYPES.index(t) for t, _ in building_data], dtype=np.uint8)
+    counts = np.array([len(coords) for _, coords in building_data], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    vertices = np.array([xy for _, coords in building_data for xy in coords], dtype=np.float32).reshape(-1, 2)
+    return {'types': types, 'offsets': offsets, 'vertices': vertices}
+
+def unpack_buildings(packed):
+    """
+    Inverse of pack_buildings, giving back [type, [(x, y), ...]] lists.
+    """
+    vertices = np.asarray(packed['vertices'], dtype=np.float64)
+    offsets = packed['offsets']
+    return [[BUILDING_TYPES[code], [tuple(xy) for xy in vertices[offsets[k]:offsets[k + 1]]]]
+            for k, code in enumerate(packed['types'])]
+
+def quantize_vertices(vertices, quantum):
+    """
+    Stores vertices as int32 multiples of `quantum` metres relative to
+    their minimum corner. Returns the ints and the origin.
+    """
+    origin = vertices.min(axis=0) if len(vertices) else np.zeros(2)
+    return np.round((vertices - origin) / quantum).astype(np.int32), origin
+
+def write_buildings_npz(path, building_data):
+    np.savez(path, **pack_buildings(building_data))
+
+def encode_chunk(arrays, header):
+    """
+    Serialises a dict of arrays as one chunk: MAGIC, a uint32 header
+    length, the JSON header, then each array at the offset the header gives
+    (8-byte aligned, relative to the end of the header). header['size'] is
+    the length of the data section, so chunks can be appended back to back.
+    """
+    header = dict(header, arrays={})
+    position = 0
+    for name, array in arrays.items():
+        position = -(-position // ALIGN) * ALIGN
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position += array.nbytes
+    header['size'] = -(-position // ALIGN) * ALIGN
+    header_bytes = json.dumps(header).encode()
+    prefix = MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes
+    start = -len(prefix) % ALIGN
+    data = bytearray(start + header['size'])
+    for name, array in arrays.items():
+        offset = start + header['arrays'][name]['offset']
+        data[offset:offset + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    return prefix + bytes(data)
+
+def read_chunk(path, position=0):
+    """
+    Maps the chunk starting at byte `position` of path without copying it.
+    Returns the header, a dict of read-only memmapped arrays and the
+    position of the next chunk, or None at the end of the file.
+    """
+    with open(path, 'rb') as f:
+        f.seek(position)
+        magic = f.read(len(MAGIC))
+        if magic == b'':
+            return None
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a city file")
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    start = position + -(-(len(MAGIC) + 4 + length) // ALIGN) * ALIGN
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        shape = tuple(spec['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            continue
+        arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=start + spec['offset'], shape=shape)
+    return header, arrays, start + header['size']
+
+def iter_chunks(path):
+    """
+    Yields (header, arrays) for every chunk appended to path.
+    """
+    position = 0
+    while True:
+        chunk = read_chunk(path, position)
+        if chunk is None:
+            return
+        header, arrays, position = chunk
+        yield header, arrays
+
+def write_buildings_bin(path, building_data, quantum=None):
+    """
+    Writes buildings as a flat binary file of one chunk (see encode_chunk).
+    If quantum is set, vertices are stored as int32 multiples of quantum
+    metres from header['origin'].
+    """
+    packed = pack_buildings(building_data)
+    header = {'version': 1, 'types': BUILDING_TYPES}
+    if quantum is not None:
+        packed['vertices'], origin = quantize_vertices(packed['vertices'], quantum)
+        header['quantum'] = quantum
+        header['origin'] = [float(v) for v in origin]
+    with open(path, 'wb') as f:
+        f.write(encode_chunk(packed, header))
+
+def read_buildings_bin(path):
+    """
+    Maps a file written by write_buildings_bin without copying it.
+    Returns the header and a dict of read-only memmapped arrays.
+    """
+    header, arrays, _ = read_chunk(path)
+    return header, arrays
+
+def dequantize_vertices(header, vertices):
+    """
+    Vertex coordinates in metres, undoing write_buildings_bin's quantum.
+    """
+    if 'quantum' not in header:
+        return vertices
+    return vertices * header['quantum'] + np.array(header['origin'])
+
+def read_buildings(path):
+    """
+    Loads buildings written in any of the supported formats (.json, .npz
+    or the flat binary) as [type, [(x, y), ...]] lists.
+    """
+    if str(path).endswith('.json'):
+        with open(path, 'r') as f:
+            return json.load(f)
+    if str(path).endswith('.npz'):
+        with np.load(path) as data:
+            return unpack_buildings(data)
+    header, arrays = read_buildings_bin(path)
+    arrays['vertices'] = dequantize_vertices(header, arrays['vertices'])
+    return unpack_buildings(arrays)
+
+def write_buildings(path, building_data, quantum=None):
+    """
+    Writes buildings in the format given by the extension of path:
+    .json (the original building_data.json layout), .npz, or anything else
+    for the flat binary.
+    """
+    if str(path).endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(list(building_data), f, indent=4)
+    elif str(path).endswith('.npz'):
+        write_buildings_npz(path, building_data)
+    else:
+        write_buildings_bin(path, building_data, quantum)
+
+def blob_record(index, blob, result):
+    """
+    Plain JSON-ready record of one generated blob.
+    """
+    return {'blob': index, 'id': blob['id'], 'junctions': np.asarray(result['Junctions']).tolist(),
+            'edges': np.asarray(result['Edges']).tolist(), 'buildings': list(result['Buildings'])}
+
+def blob_chunk(index, blob, result):
+    """
+    One blob's roads and buildings encoded as a binary chunk.
+    """
+    arrays = pack_buildings(result['Buildings'])
+    arrays['junctions'] = np.asarray(result['Junctions'], dtype=np.float32).reshape(-1, 2)
+    arrays['edges'] = np.asarray(result['Edges'], dtype=np.int32).reshape(-1, 2)
+    return encode_chunk(arrays, {'version': 1, 'types': BUILDING_TYPES, 'blob': index, 'id': blob['id']})
+
+def write_city_stream(path, stream):
+    """
+    Writes (index, blob, result) items from a generator such as
+    citygen.iter_city as they arrive, one NDJSON line per blob if path ends
+    in .ndjson, otherwise one appended binary chunk per blob. Each blob is
+    flushed before the next is generated. Returns the number of blobs.
+    """
+    count = 0
+    ndjson = str(path).endswith('.ndjson')
+    with open(path, 'w' if ndjson else 'wb') as f:
+        for index, blob, result in stream:
+            if ndjson:
+                f.write(json.dumps(blob_record(index, blob, result)) + '\n')
+            else:
+                f.write(blob_chunk(index, blob, result))
+            f.flush()
+            count += 1
+    return count
+
+def read_city_stream(path):
+    """
+    Yields the blob records of a file written by write_city_stream, one at
+    a time, in the order they were written.
+    """
+    if str(path).endswith('.ndjson'):
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    for header, arrays in iter_chunks(path):
+        yield {'blob': header['blob'], 'id': header['id'], 'junctions': arrays['junctions'],
+               'edges': arrays['edges'], 'buildings': unpack_buildings(arrays)}
+
+def repair_shape(shape):
+    """
+    Converts a cityShapes entry's outerPolygon to a float64 (N, 2) array,
+    repairing invalid (e.g. self-intersecting) outlines with buffer(0).
+    If the repair splits the outline, the largest part is kept.
+    """
+    coords = np.asarray(shape["outerPolygon"], dtype=np.float64)
+    if coords.ndim != 2 or coords.shape[1] != 2 or len(coords) < 3:
+        raise ValueError(f"shape {shape.get('id')!r} has no valid outerPolygon")
+    polygon = Polygon(coords)
+    if not polygon.is_valid:
+        polygon = polygon.buffer(0)
+        if polygon.geom_type == 'MultiPolygon':
+            polygon = max(polygon.geoms, key=lambda part: part.area)
+        if polygon.is_empty:
+            raise ValueError(f"shape {shape.get('id')!r} has an empty outerPolygon")
+        coords = np.asarray(polygon.exterior.coords)[:-1]
+    return dict(shape, outerPolygon=coords)
+
+def iter_city_shapes(source, chunk_size=1 << 16):
+    """
+    Yields the entries of an exportData document's "cityShapes" array one
+    at a time, repaired by repair_shape, reading source (a path or a text
+    file object) in chunks so the whole document is never held in memory.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r') as f:
+            yield from iter_city_shapes(f, chunk_size)
+        return
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    size = chunk_size
+
+    def more():
+        nonlocal buffer, pos, eof
+        data = source.read(size)
+        eof = data == ''
+        buffer = buffer[pos:] + data
+        pos = 0
+        return not eof
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or not more():
+                return
+
+    def expect(chars):
+        nonlocal pos
+        skip_space()
+        char = buffer[pos:pos + 1]
+        if not char or char not in chars:
+            raise ValueError("malformed cityShapes document")
+        pos += 1
+        return char
+
+    def decode():
+        nonlocal pos, size
+        skip_space()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a number ending with the buffer may go on in the next chunk
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # double the read on every retry, so a value spanning many
+            # chunks is only decoded a logarithmic number of times
+            size *= 2
+            more()
+        size = chunk_size
+        pos = end
+        return value
+
+    # walk the top-level object's keys to "cityShapes", skipping other values
+    expect('{')
+    while True:
+        skip_space()
+        if buffer[pos:pos + 1] != '"':
+            raise ValueError("no cityShapes array in input")
+        key = decode()
+        expect(':')
+        if key == 'cityShapes':
+            break
+        decode()
+        if expect(',}') == '}':
+            raise ValueError("no cityShapes array in input")
+    expect('[')
+    skip_space()
+    if buffer[pos:pos + 1] == ']':
+        return
+    while True:
+        yield repair_shape(decode())
+        if expect(',]') == ']':
+            return
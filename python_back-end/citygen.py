@@ -0,0 +1,316 @@
+# citygen
+# Headless city generation: road grids, road unions and building fills for
+# every blob, returned as plain arrays. Nothing here imports matplotlib;
+# drawing lives in blobwise_plotting.
+
+import numpy as np
+from shapely.geometry import Polygon as ShapelyPolygon, MultiLineString
+from shapely.ops import unary_union
+from scipy.sparse import coo_matrix, triu
+import os
+import shapely
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from Blob2Graph import Blob2Graph
+from city_io import iter_city_shapes, write_buildings, write_city_stream
+from metrics import Metrics
+from placement import BuildingStore, OccupancyRaster, sample_rectangles, rectangle_corners, prefilter_rectangles, street_blocks
+
+region_info = {
+    "Residential": {"density": 7, "probabilities": {"residential": 0.8, "commercial": 0.15, "industrial": 0.05}, "fill_attempts": 100},
+    "Town Centre": {"density": 8, "probabilities": {"residential": 0.4, "commercial": 0.5, "industrial": 0.1}, "fill_attempts": 80},
+    "Market": {"density": 10, "probabilities": {"residential": 0.3, "commercial": 0.6, "industrial": 0.1}, "fill_attempts": 70},
+    "Commercial": {"density": 12, "probabilities": {"residential": 0.2, "commercial": 0.7, "industrial": 0.1}, "fill_attempts": 60},
+    "Industrial": {"density": 12, "probabilities": {"residential": 0.1, "commercial": 0.2, "industrial": 0.7}, "fill_attempts": 50}
+}
+building_styles = {
+    "residential": {"colour": "blue", "dimensions": (1, 6)},
+    "industrial": {"colour": "purple", "dimensions": (3, 10)},
+    "commercial": {"colour": "red", "dimensions": (4, 7)},
+}
+
+
+def grid_key(blob):
+    """
+    (outline, density) a blob's road grid is cached under in a RoadCache.
+    """
+    return np.array(blob["outerPolygon"]), region_info[blob["id"]]["density"]
+
+def road_grid(blob, cache=None, metrics=None):
+    """
+    Road grid for an individual blob, before exclusions, and whether it was
+    built here. With a RoadCache, grids seen before (same outline and
+    density) are reused and new ones are added to it.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    borderArray, density = grid_key(blob)
+    if cache is not None:
+        road_data = cache.get(borderArray, density)
+        if road_data is not None:
+            metrics.count('grid.cache_hits')
+            return road_data, False
+    junctions, roads = Blob2Graph(borderArray, density)
+    metrics.count('grid.nodes', len(junctions))
+    metrics.count('grid.edges', roads.nnz // 2)
+    road_data = {'Junctions': junctions, 'Roads': roads, 'Pitch': density}
+    if cache is not None:
+        cache.put(borderArray, density, road_data)
+    return road_data, True
+
+def generate_blob_grid(blob, cache=None, metrics=None, exclusions=None):
+    """
+    Generates a road grid for an individual blob (see road_grid). Roads
+    crossing a river or park of `exclusions` (an ExclusionMask) are removed.
+    """
+    road_data, _ = road_grid(blob, cache, metrics)
+    return exclude_roads(road_data, exclusions, metrics)
+
+def exclude_roads(road_data, exclusions, metrics=None):
+    """
+    Copy of road_data without the roads that cross a river or park, tested
+    in one batch. The cached grid itself is left whole.
+    """
+    if exclusions is None:
+        return road_data
+    edges = road_edges(road_data)
+    blocked = exclusions.blocked_segments(road_data['Junctions'][edges])
+    if not blocked.any():
+        return road_data
+    if metrics is not None:
+        metrics.count('grid.excluded_edges', int(blocked.sum()))
+    i, j = edges[~blocked].T
+    n = len(road_data['Junctions'])
+    roads = coo_matrix((np.ones(2 * len(i)), (np.r_[i, j], np.r_[j, i])), shape=(n, n)).tocsr()
+    return dict(road_data, Roads=roads)
+
+def road_edges(road_data):
+    """
+    Junction index pairs (E, 2), one per road segment of the grid.
+    """
+    return np.column_stack(triu(road_data['Roads']).nonzero())
+
+def road_union(junctions, edges):
+    """
+    Union of the road segments as a single shapely geometry.
+    """
+    return unary_union(MultiLineString(list(junctions[edges])))
+
+def place_building(building_type, blob, filled_space, road_network, attempts=50, rng=np.random, raster=None, metrics=None, exclusions=None):
+    """
+    Tries up to `attempts` random footprints of building_type and adds the
+    first that fits to filled_space (a BuildingStore). Returns its index in
+    the store, or None.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    metrics.count(f'placement.{building_type}.requested')
+    dimensions = building_styles[building_type]["dimensions"]
+    free_centres = None
+    if raster is not None:
+        # only centre candidates where the shortest side still fits
+        free_centres = raster.sample_centres(attempts, dimensions[0], rng)
+        if free_centres is None:
+            return None
+    # draw every attempt at once and drop the ones that leave the blob
+    centres, widths, heights, rotations = sample_rectangles(blob.bounds, dimensions, attempts, rng, free_centres)
+    corners = rectangle_corners(centres, widths, heights, rotations)
+    metrics.count(f'placement.{building_type}.candidates', len(corners))
+    keep = prefilter_rectangles(corners, blob)
+    metrics.count(f'placement.{building_type}.prefiltered', int(keep.sum()))
+    if raster is not None:
+        # footprints reaching into occupied space never get to shapely
+        keep[keep] = raster.fits(corners[keep])
+        metrics.count(f'placement.{building_type}.unoccupied', int(keep.sum()))
+    if exclusions is not None:
+        keep[keep] = exclusions.clear(corners[keep])
+        metrics.count(f'placement.{building_type}.unexcluded', int(keep.sum()))
+    candidates = np.flatnonzero(keep)
+    # the store only changes once a building is placed, so every candidate
+    # can be checked against it in one go
+    collides = filled_space.collides(corners[candidates])
+    for row, (k, building) in enumerate(zip(candidates, shapely.polygons(corners[candidates]))):
+        metrics.count(f'placement.{building_type}.tested')
+        if (blob.contains(building) and 
+            not collides[row] and 
+            (road_network is None or not road_network.intersects(building))):
+            if raster is not None:
+                raster.mark(centres[k], widths[k], heights[k], rotations[k])
+            metrics.count(f'placement.{building_type}.placed')
+            return filled_space.add(building_type, centres[k], widths[k], heights[k], rotations[k])
+    return None
+
+def fill_block(block, building_types, rng=np.random, metrics=None, exclusions=None):
+    """
+    Packs buildings into one street block, trying each of building_types in
+    turn. The block is already clear of the roads and blocks never overlap,
+    so candidates are only checked against the block's own buildings.
+    Returns a BuildingStore.
+    """
+    filled_space = BuildingStore()
+    shapely.prepare(block)
+    for building_type in building_types:
+        place_building(building_type, block, filled_space, None, rng=rng, metrics=metrics, exclusions=exclusions)
+    return filled_space
+
+def add_block_buildings(blob, road_network, rng=np.random, metrics=None, exclusions=None):
+    """
+    Fills a blob street block by street block. The blob's fill attempts are
+    shared out between its blocks in proportion to their area, then each
+    block is filled on its own.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    polyBlob = ShapelyPolygon(blob["outerPolygon"])
+    blocks = street_blocks(polyBlob, road_network)
+    metrics.count('placement.blocks', len(blocks))
+    if len(blocks) == 0:
+        return BuildingStore()
+    info = region_info[blob["id"]]
+    types = rng.choice(['residential', 'commercial', 'industrial'], size=info["fill_attempts"], p=list(info["probabilities"].values()))
+    areas = shapely.area(blocks)
+    owners = rng.choice(len(blocks), size=len(types), p=areas / areas.sum())
+    # each block draws from its own stream, so blocks can be filled in any order
+    seeds = np.random.SeedSequence(int(rng.uniform(0, 2**52))).spawn(len(blocks))
+    return BuildingStore.concatenate([fill_block(blocks[index], types[owners == index], np.random.default_rng(seeds[index]), metrics, exclusions)
+                                      for index in np.unique(owners)])
+
+def add_req_buildings(blob, road_network, mode="uniform", rng=np.random, metrics=None, exclusions=None):
+    """
+    Fills a blob with buildings. mode "uniform" samples candidates over the
+    blob's bounding box; mode "raster" keeps an occupancy raster of the free
+    space, centres candidates only in free space and rejects most misfits
+    against the raster before any shapely test; mode "blocks"
+    splits the blob into street blocks and fills each one separately.
+    Candidates overlapping `exclusions` (an ExclusionMask) are rejected.
+    Returns the buildings as a BuildingStore.
+    """
+    if mode == "blocks":
+        return add_block_buildings(blob, road_network, rng, metrics, exclusions)
+    # collisions are ruled out by bounding box before any footprint is built
+    filled_space = BuildingStore()
+    polyBlob = ShapelyPolygon(blob["outerPolygon"])
+    shapely.prepare(polyBlob)
+    shapely.prepare(road_network)
+    raster = OccupancyRaster(polyBlob, road_network) if mode == "raster" else None
+    for _ in range(region_info[blob["id"]]["fill_attempts"]):
+        building_type = rng.choice(['residential', 'commercial', 'industrial'], p=list(region_info[blob["id"]]["probabilities"].values()))
+        place_building(building_type, polyBlob, filled_space, road_network, rng=rng, raster=raster, metrics=metrics,
+                       exclusions=exclusions)
+    return filled_space
+
+def buildable_blobs(blobData):
+    """
+    Yields the blobs to fill, from an exportData dict or any iterable of
+    cityShapes entries (e.g. city_io.iter_city_shapes). Parks are skipped;
+    use them as exclusions (see exclusions.ExclusionMask.from_city).
+    """
+    shapes = blobData["cityShapes"] if isinstance(blobData, dict) else blobData
+    for blob in shapes:
+        if blob["id"][0:4] == "Park": # Don't fill parks with houses
+            continue
+        yield blob
+
+def generate_blob(blob, seed=None, mode="uniform", cache=None, exclusions=None, road_data=None):
+    """
+    Generates the roads and buildings of one blob, keeping both out of
+    `exclusions` (an ExclusionMask) if given. Returns plain arrays only, so
+    it can run in a worker process, plus the blob's Metrics summary (stage
+    times and counters). `road_data` is a road grid the caller already
+    looked up, e.g. in a parent process's RoadCache; a grid built here is
+    returned as 'Grid' too, so the caller can add it to that cache.
+    """
+    metrics = Metrics()
+    rng = np.random.default_rng(seed)
+    with metrics.stage('grid'):
+        built = False
+        if road_data is None:
+            road_data, built = road_grid(blob, cache, metrics)
+        else:
+            metrics.count('grid.cache_hits')
+        grid = exclude_roads(road_data, exclusions, metrics)
+    junctions = grid['Junctions']
+    with metrics.stage('roads'):
+        edges = road_edges(grid)
+        roads = road_union(junctions, edges)
+    with metrics.stage('placement'):
+        buildings = add_req_buildings(blob, roads, mode, rng, metrics, exclusions)
+    result = {'Junctions': junctions, 'Edges': edges, 'Buildings': buildings, 'Metrics': metrics.summary()}
+    if built:
+        result['Grid'] = road_data
+    return result
+
+def iter_city(blobData, workers=None, seed=None, mode="uniform", cache=None, metrics=None, exclusions=None):
+    """
+    Generates every buildable blob in a process pool of `workers` processes
+    (all cores if None, in-process if 1) and yields (index, blob, result)
+    as soon as each blob finishes, so callers can use early districts while
+    later ones are still generating. Each blob gets its own child of
+    SeedSequence(seed), so results do not depend on the worker count.
+    Road grids are looked up in / added to `cache` (a RoadCache) if given.
+    Blobs are read from blobData lazily, with at most two per worker in
+    flight, so a streamed input is never fully resident. Each blob's stage
+    times and counters are merged into `metrics` (a Metrics) if given.
+    Roads and buildings are kept out of `exclusions` (an ExclusionMask).
+    """
+    # spawning children one at a time gives the same seeds as spawn(n)
+    seeds = np.random.SeedSequence(seed)
+    jobs = ((index, blob, seeds.spawn(1)[0]) for index, blob in enumerate(buildable_blobs(blobData)))
+    for index, blob, result in run_blobs(jobs, workers, mode, cache, exclusions):
+        if metrics is not None:
+            metrics.add_blob(index, blob["id"], result['Metrics'])
+        yield index, blob, result
+
+def run_blobs(jobs, workers=None, mode="uniform", cache=None, exclusions=None):
+    """
+    Runs generate_blob for each (index, blob, seed) job, in-process if
+    workers is 1 and otherwise in a process pool, yielding
+    (index, blob, result) in completion order. With a pool, `cache` stays
+    in this process: grids are looked up before a job is submitted and the
+    ones workers build are added as their results come back.
+    """
+    if workers == 1:
+        for index, blob, seed in jobs:
+            result = generate_blob(blob, seed, mode, cache, exclusions)
+            result.pop('Grid', None)
+            yield index, blob, result
+        return
+
+    def finish(future):
+        index, blob = pending.pop(future)
+        result = future.result()
+        road_data = result.pop('Grid', None)
+        if cache is not None and road_data is not None:
+            cache.put(*grid_key(blob), road_data)
+        return index, blob, result
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for index, blob, seed in jobs:
+            road_data = cache.get(*grid_key(blob)) if cache is not None else None
+            pending[pool.submit(generate_blob, blob, seed, mode, None, exclusions, road_data)] = (index, blob)
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # drop the finished future so its result is not held until the end
+                    yield finish(future)
+        for future in as_completed(list(pending)):
+            yield finish(future)
+
+def generate_city(blobData, workers=None, seed=None, mode="uniform", cache=None, metrics=None, exclusions=None):
+    """
+    Generates every buildable blob (see iter_city) and returns the results
+    in blob order.
+    """
+    results = {index: result for index, _, result in iter_city(blobData, workers, seed, mode, cache, metrics, exclusions)}
+    return [results[index] for index in sorted(results)]
+
+if __name__ == '__main__':
+    import sys
+    blobData = iter_city_shapes(sys.argv[1])
+    path = sys.argv[2] if len(sys.argv) > 2 else "building_data.json"
+    if path.endswith('.ndjson') or path.endswith('.chunks'):
+        # stream each blob to disk as soon as it is generated
+        write_city_stream(path, iter_city(blobData))
+    else:
+        write_buildings(path, BuildingStore.concatenate([result['Buildings'] for result in generate_city(blobData)]))
@@ -0,0 +1,135 @@
+# ensemble
+# Several candidate layouts of one cityShapes input, one per explicit seed.
+# Road grids, road unions, exclusions and the road graph used for scoring
+# do not depend on the seed, so they are built once and shared; only the
+# building placements run per variant, in a process pool. Each variant is
+# scored and the ranking is returned instead of writing every layout out.
+# Variant seed s gives exactly the buildings of generate_city(seed=s), so
+# the chosen layout can be regenerated in full.
+#
+#   python ensemble.py exportData.txt [--seeds 1 2 3 | --variants 8] [--output ranking.json]
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+import citygen
+from city_io import BUILDING_TYPES, pack_buildings
+from exclusions import ExclusionMask
+from metrics import Metrics
+from placement import BuildingStore
+from road_graph import RoadGraph, merge_road_graphs, road_access
+
+
+def place_variants(blob, road_data, seeds, mode="uniform", exclusions=None):
+    """
+    Buildings of one blob for each of seeds, all on the same road grid.
+    """
+    roads = citygen.road_union(road_data['Junctions'], citygen.road_edges(road_data))
+    return [citygen.add_req_buildings(blob, roads, mode, np.random.default_rng(seed), exclusions=exclusions)
+            for seed in seeds]
+
+def footprint_areas(building_data):
+    """
+    Area of every [type, ring] building, by the shoelace formula over the
+    packed vertices.
+    """
+    packed = pack_buildings(building_data)
+    vertices = packed['vertices'].astype(np.float64)
+    if len(vertices) == 0:
+        return np.zeros(0)
+    following = np.roll(vertices, -1, axis=0)
+    cross = vertices[:, 0] * following[:, 1] - following[:, 0] * vertices[:, 1]
+    # rings are closed, so only the term joining one ring to the next is dropped
+    cross[packed['offsets'][1:] - 1] = 0
+    return np.abs(np.add.reduceat(cross, packed['offsets'][:-1])) / 2
+
+def score_variant(building_data, buildable_area, road_graph, access_distance=5.0):
+    """
+    Fill ratio (building footprint over buildable area), building counts
+    by type and distances from building centres to the nearest road.
+    The score is the fill ratio times the fraction of buildings within
+    access_distance of a road.
+    """
+    fill = float(footprint_areas(building_data).sum() / buildable_area) if buildable_area > 0 else 0.0
+    counts = dict(zip(BUILDING_TYPES, np.bincount(pack_buildings(building_data)['types'], minlength=len(BUILDING_TYPES)).tolist()))
+    distances = road_access(road_graph, building_data)
+    within = float(np.mean(distances <= access_distance)) if len(distances) else 0.0
+    return {'score': fill * within, 'fill_ratio': fill, 'buildings': counts,
+            'road_access': {'mean': float(distances.mean()) if len(distances) else None,
+                            'max': float(distances.max()) if len(distances) else None,
+                            'within': within}}
+
+def generate_ensemble(blobData, seeds, workers=None, mode="uniform", cache=None, exclusions=None,
+                      access_distance=5.0, metrics=None):
+    """
+    Generates one variant per seed and returns their scores (see
+    score_variant), best first, each with its seed.
+    Placements run in a pool of `workers` processes (all cores if None,
+    in-process if 1), split into jobs of one blob and a share of the seeds.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    seeds = list(seeds)
+    if not seeds:
+        return []
+    blobs = list(citygen.buildable_blobs(blobData))
+    with metrics.stage('ensemble.grids'):
+        grids = [citygen.generate_blob_grid(blob, cache, metrics, exclusions) for blob in blobs]
+        road_graph, _ = merge_road_graphs([RoadGraph.from_road_data(grid) for grid in grids],
+                                          outlines=[blob["outerPolygon"] for blob in blobs], exclusions=exclusions)
+        outlines = [Polygon(blob["outerPolygon"]).buffer(0) for blob in blobs]
+        buildable = shapely.union_all(outlines)
+        if exclusions is not None:
+            buildable = buildable.difference(exclusions.geometry)
+    # the same per-blob seeds generate_city gives each of these seeds
+    blob_seeds = [np.random.SeedSequence(seed).spawn(len(blobs)) for seed in seeds]
+    workers = workers or os.cpu_count()
+    chunks = min(len(seeds), max(1, -(-2 * workers // max(len(blobs), 1))))
+    jobs = [(index, part) for index in range(len(blobs)) for part in np.array_split(np.arange(len(seeds)), chunks)
+            if len(part)]
+    variants = [[] for _ in seeds]
+    with metrics.stage('ensemble.placement'):
+        if workers == 1:
+            outputs = [place_variants(blobs[index], grids[index], [blob_seeds[v][index] for v in part], mode, exclusions)
+                       for index, part in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(place_variants, blobs[index], grids[index],
+                                       [blob_seeds[v][index] for v in part], mode, exclusions)
+                           for index, part in jobs]
+                outputs = [future.result() for future in futures]
+        # keep each variant's buildings in blob order, as generate_city does
+        for (index, part), output in zip(jobs, outputs):
+            for v, buildings in zip(part, output):
+                variants[v].append((index, buildings))
+    with metrics.stage('ensemble.scoring'):
+        ranking = []
+        for seed, blob_buildings in zip(seeds, variants):
+            building_data = BuildingStore.concatenate([buildings for _, buildings in sorted(blob_buildings, key=lambda item: item[0])])
+            ranking.append(dict(score_variant(building_data, buildable.area, road_graph, access_distance), seed=seed))
+    metrics.count('ensemble.variants', len(seeds))
+    return sorted(ranking, key=lambda entry: entry['score'], reverse=True)
+
+if __name__ == '__main__':
+    from city_io import iter_city_shapes
+    parser = argparse.ArgumentParser(description='Generate and rank seeded variants of a city.')
+    parser.add_argument('source')
+    parser.add_argument('--seeds', type=int, nargs='+', default=None)
+    parser.add_argument('--variants', type=int, default=8, help='seeds 0..N-1 if --seeds is not given')
+    parser.add_argument('--mode', default='uniform')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='write the ranking as JSON')
+    args = parser.parse_args()
+    blobData = {"cityShapes": list(iter_city_shapes(args.source))}
+    seeds = args.seeds if args.seeds is not None else range(args.variants)
+    ranking = generate_ensemble(blobData, seeds, args.workers, args.mode, exclusions=ExclusionMask.from_city(blobData))
+    for entry in ranking:
+        print(f"seed {entry['seed']}: score {entry['score']:.4f}, fill {entry['fill_ratio']:.4f}, "
+              f"{sum(entry['buildings'].values())} buildings, {entry['road_access']['within']:.0%} near a road")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(ranking, f, indent=4)
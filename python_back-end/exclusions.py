@@ -0,0 +1,141 @@
+# exclusions
+# Areas no road or building may use: river corridors, the border road
+# around each blob and parks. Every layer is offset with NumPy, the layers
+# are unioned once and the result is prepared, so rejecting a batch of
+# candidates is one vectorised shapely call.
+
+import numpy as np
+import shapely
+from shapely.geometry import LinearRing, LineString, Polygon
+
+# longest mitre, in half widths, before a bend is bevelled instead
+MITRE_LIMIT = 5.0
+
+
+def offset_polyline(points, width, closed=False):
+    """
+    Offsets a polyline by width / 2 to either side. Each vertex moves along
+    the mitred average of the normals of its two segments (the end vertices
+    of an open line along their one segment's normal). Returns the (N, 2)
+    left and right offset lines and whether every mitre was within
+    MITRE_LIMIT; if not, the sharpest bends are cut short and the lines are
+    narrower there.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if closed and len(points) > 1 and np.array_equal(points[0], points[-1]):
+        points = points[:-1]
+    # repeated vertices have no direction
+    following = np.roll(points, -1, axis=0) if closed else points[1:]
+    keep = np.ones(len(points), dtype=bool)
+    keep[:len(following)] = np.any(points[:len(following)] != following, axis=1)
+    points = points[keep]
+    step = np.roll(points, -1, axis=0) - points if closed else np.diff(points, axis=0)
+    normals = np.c_[-step[:, 1], step[:, 0]] / np.linalg.norm(step, axis=1)[:, None]
+    if closed:
+        before, after = np.roll(normals, 1, axis=0), normals
+    else:
+        before = np.vstack([normals[:1], normals])
+        after = np.vstack([normals, normals[-1:]])
+    mitre = before + after
+    length = np.linalg.norm(mitre, axis=1)
+    # a line doubling back on itself has no mitre; keep the outgoing normal
+    reverse = length < 1e-9
+    mitre[reverse] = after[reverse]
+    length[reverse] = 1.0
+    mitre /= length[:, None]
+    # lengthen the mitre at bends so the corridor keeps its width
+    cos = np.sum(mitre * after, axis=1)
+    mitre /= np.maximum(cos, 1 / MITRE_LIMIT)[:, None]
+    offset = width / 2 * mitre
+    return points + offset, points - offset, bool(np.all(cos >= 1 / MITRE_LIMIT) and not reverse.any())
+
+def corridor(points, width):
+    """
+    Polygon covering an open polyline (e.g. a river centreline) widened to
+    width. Bends too sharp to mitre fall back to shapely's bevelled buffer.
+    """
+    left, right, mitred = offset_polyline(points, width)
+    if not mitred:
+        return LineString(points).buffer(width / 2, cap_style='flat', join_style='mitre', mitre_limit=MITRE_LIMIT)
+    return Polygon(np.vstack([left, right[::-1]])).buffer(0)
+
+def border_band(points, width):
+    """
+    Band of the given width centred on a closed outline, bevelled like
+    corridor at bends too sharp to mitre.
+    """
+    left, right, mitred = offset_polyline(points, width, closed=True)
+    if not mitred:
+        return LinearRing(points).buffer(width / 2, join_style='mitre', mitre_limit=MITRE_LIMIT)
+    return shapely.symmetric_difference(Polygon(left).buffer(0), Polygon(right).buffer(0))
+
+
+class ExclusionMask:
+    """
+    Union of the excluded areas, prepared for repeated queries. rivers is
+    a list of (centreline, width) pairs, borders a list of blob outlines
+    widened to road_width, and parks a list of park outlines.
+    Roads may run along blob borders, so roads are only rejected against
+    rivers and parks; buildings are rejected against everything.
+    """
+
+    def __init__(self, rivers=(), borders=(), parks=(), road_width=2.0):
+        self.road_width = road_width
+        water = [corridor(centreline, width) for centreline, width in rivers]
+        green = [Polygon(np.asarray(outline, dtype=np.float64)).buffer(0) for outline in parks]
+        bands = [border_band(outline, road_width) for outline in borders]
+        self.blocked = shapely.union_all(water + green)
+        self.geometry = shapely.union_all([self.blocked] + bands)
+        self._prepare()
+
+    def __setstate__(self, state):
+        # preparation is not pickled, so redo it in worker processes
+        self.__dict__.update(state)
+        self._prepare()
+
+    def _prepare(self):
+        shapely.prepare(self.blocked)
+        shapely.prepare(self.geometry)
+
+    @classmethod
+    def from_city(cls, blobData, rivers=(), road_width=2.0):
+        """
+        Mask for an exportData dict or iterable of cityShapes entries: the
+        outline of every blob is a border and "Park" blobs are parks.
+        """
+        shapes = blobData["cityShapes"] if isinstance(blobData, dict) else blobData
+        borders, parks = [], []
+        for shape in shapes:
+            borders.append(shape["outerPolygon"])
+            if shape["id"][0:4] == "Park":
+                parks.append(shape["outerPolygon"])
+        return cls(rivers, borders, parks, road_width)
+
+    def contains_xy(self, x, y):
+        """
+        True for each point inside the excluded area.
+        """
+        return shapely.contains_xy(self.geometry, x, y)
+
+    def blocked_segments(self, segments):
+        """
+        True for each of the (E, 2, 2) road segments that enters a river or
+        a park. Segments that only touch one, such as roads ending on a park
+        border or running along it, are not blocked.
+        """
+        if len(segments) == 0:
+            return np.zeros(0, dtype=bool)
+        lines = shapely.linestrings(segments)
+        blocked = shapely.intersects(self.blocked, lines)
+        # only segments that meet the blocked area need the full relate
+        blocked[blocked] = shapely.relate_pattern(self.blocked, lines[blocked], 'T********')
+        return blocked
+
+    def clear(self, corners):
+        """
+        True for each of the (k, 4, 2) rectangles that stays out of the
+        excluded area.
+        """
+        if len(corners) == 0:
+            return np.zeros(0, dtype=bool)
+        return ~shapely.intersects(self.geometry, shapely.polygons(corners))
@@ -0,0 +1,129 @@
+# incremental
+# Regenerates only the blobs an edit touched. The previous run's blobs are
+# kept (optionally on disk) keyed by a hash of their content; on the next
+# run, blobs whose content is unchanged and that are not next to a changed
+# blob, park or river reuse their old roads and buildings.
+
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+import citygen
+from exclusions import ExclusionMask, corridor
+
+
+def blob_key(blob, seed, mode):
+    """
+    Hash of everything that determines a blob's result: its outline, its
+    region settings, the base seed and the placement mode.
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(blob["outerPolygon"], dtype=np.float64).tobytes())
+    digest.update(json.dumps([blob["id"], citygen.region_info[blob["id"]], seed, mode], sort_keys=True).encode())
+    return digest.hexdigest()
+
+def excluded_areas(shapes, rivers=()):
+    """
+    Keyed outlines of the parks among shapes and of the river corridors,
+    for spotting which of them changed between runs.
+    """
+    areas = []
+    for shape in shapes:
+        if shape["id"][0:4] == "Park":
+            coords = np.ascontiguousarray(shape["outerPolygon"], dtype=np.float64)
+            key = hashlib.sha1(b'park' + coords.tobytes()).hexdigest()
+            areas.append({'key': key, 'outline': Polygon(coords).buffer(0)})
+    for centreline, width in rivers:
+        coords = np.ascontiguousarray(centreline, dtype=np.float64)
+        key = hashlib.sha1(b'river' + coords.tobytes() + repr(float(width)).encode()).hexdigest()
+        areas.append({'key': key, 'outline': corridor(coords, width)})
+    return areas
+
+
+class IncrementalCity:
+    """
+    Keeps the last generated city and updates it from a new cityShapes
+    export. Blobs that are new or changed are regenerated, as are unchanged
+    blobs within neighbour_distance of a changed (added, moved or removed)
+    blob, park or river; everything else is reused. Each blob's seed comes from its content
+    hash, so a reused blob and a regenerated copy of it match.
+    If state_path is given the state is loaded from and saved to it.
+    """
+
+    def __init__(self, state_path=None, seed=0, mode="uniform", neighbour_distance=1.0, workers=None, cache=None):
+        self.state_path = state_path
+        self.seed = seed
+        self.mode = mode
+        self.neighbour_distance = neighbour_distance
+        self.workers = workers
+        self.cache = cache
+        self.blobs = []
+        self.areas = []
+        self.stats = {}
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                state = pickle.load(f)
+            # older states were a bare blob list built without exclusions
+            if isinstance(state, dict):
+                self.blobs, self.areas = state['blobs'], state['areas']
+
+    def save(self):
+        if self.state_path is None:
+            return
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'blobs': self.blobs, 'areas': self.areas}, f)
+        os.replace(tmp, self.state_path)
+
+    def _changed_outlines(self, old_keys, new_entries, new_areas):
+        new_keys = {entry['key'] for entry in new_entries}
+        removed = [entry['outerPolygon'] for entry in self.blobs if entry['key'] not in new_keys]
+        added = [entry['outerPolygon'] for entry in new_entries if entry['key'] not in old_keys]
+        outlines = [Polygon(coords).buffer(0) for coords in removed + added]
+        old_area_keys = {area['key'] for area in self.areas}
+        new_area_keys = {area['key'] for area in new_areas}
+        outlines += [area['outline'] for area in self.areas if area['key'] not in new_area_keys]
+        outlines += [area['outline'] for area in new_areas if area['key'] not in old_area_keys]
+        return outlines
+
+    def update(self, blobData, rivers=()):
+        """
+        Brings the city up to date with blobData and rivers, (centreline,
+        width) pairs, and returns the per-blob results in blob order, as
+        citygen.generate_city with ExclusionMask.from_city(blobData, rivers)
+        does.
+        """
+        shapes = blobData["cityShapes"] if isinstance(blobData, dict) else list(blobData)
+        exclusions = ExclusionMask.from_city(shapes, rivers)
+        areas = excluded_areas(shapes, rivers)
+        old = {}
+        for entry in self.blobs:
+            old.setdefault(entry['key'], entry)
+        entries = [{'key': blob_key(blob, self.seed, self.mode), 'blob': blob,
+                    'outerPolygon': np.asarray(blob["outerPolygon"], dtype=np.float64)}
+                   for blob in citygen.buildable_blobs(shapes)]
+        changed = self._changed_outlines(old.keys(), entries, areas)
+        # unchanged blobs next to a change are regenerated too
+        near_change = np.zeros(len(entries), dtype=bool)
+        if changed and entries:
+            tree = shapely.STRtree(changed)
+            outlines = [Polygon(entry['outerPolygon']).buffer(0) for entry in entries]
+            hits, _ = tree.query(outlines, predicate='dwithin', distance=self.neighbour_distance)
+            near_change[hits] = True
+        jobs = []
+        for index, entry in enumerate(entries):
+            if entry['key'] in old and not near_change[index]:
+                entry['result'] = old[entry['key']]['result']
+            else:
+                seed = np.random.SeedSequence(int(entry['key'], 16))
+                jobs.append((index, entry['blob'], seed))
+        for index, _, result in citygen.run_blobs(jobs, self.workers, self.mode, self.cache, exclusions):
+            entries[index]['result'] = result
+        self.stats = {'blobs': len(entries), 'regenerated': len(jobs), 'reused': len(entries) - len(jobs)}
+        self.blobs = [{'key': entry['key'], 'outerPolygon': entry['outerPolygon'], 'result': entry['result']}
+                      for entry in entries]
+        self.areas = areas
+        self.save()
+        return [entry['result'] for entry in self.blobs]
@@ -0,0 +1,70 @@
+# metrics
+# Stage timers and counters for the city pipeline. A Metrics object is
+# passed down through citygen; each blob records into its own object (so it
+# works inside worker processes) and the run-level object merges the blob
+# summaries. An optional callback sees every timing and count as it is
+# recorded, or as it is merged in from a worker.
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import time
+
+
+class Metrics:
+    """
+    Accumulates seconds per stage and integer counters. callback, if
+    given, is called as callback(kind, name, value) with kind "stage" or
+    "count".
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.blobs = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block and adds it to stage `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] += seconds
+        if self.callback is not None:
+            self.callback('stage', name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+        if self.callback is not None:
+            self.callback('count', name, n)
+
+    def summary(self):
+        """
+        Plain dict of everything recorded, safe to pickle or dump as JSON.
+        """
+        summary = {'stages': dict(self.stages), 'counters': dict(self.counters)}
+        if self.blobs:
+            summary['blobs'] = sorted(self.blobs, key=lambda blob: blob['index'])
+        return summary
+
+    def add_blob(self, index, blob_id, summary):
+        """
+        Merges the summary of one blob (e.g. from a worker process) into the
+        run totals and keeps it as a per-blob entry.
+        """
+        for name, seconds in summary['stages'].items():
+            self.add_time(name, seconds)
+        for name, n in summary['counters'].items():
+            self.count(name, n)
+        self.blobs.append(dict(summary, index=index, id=blob_id))
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
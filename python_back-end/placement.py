@@ -0,0 +1,391 @@
+# placement
+# Helpers for placing buildings inside a blob without testing every
+# candidate against every building already placed.
+
+import numpy as np
+import shapely
+from city_io import BUILDING_TYPES
+
+# buildings a BuildingStore scans directly before it rebuilds its STRtree
+INDEX_LAG = 256
+
+
+class BuildingStore:
+    """
+    Placed buildings as parallel NumPy arrays: type codes into
+    city_io.BUILDING_TYPES, centres, widths, heights, rotations (radians)
+    and bounding boxes, plus the corners derived from them. Bounding boxes
+    are indexed by an STRtree, rebuilt once INDEX_LAG buildings have been
+    added since the last build (newer ones are scanned directly), so a
+    query only looks at the buildings near it. Rectangle collisions are
+    tested on the arrays directly; shapely footprints are only built when
+    a query against another geometry asks for them.
+    Iterating or indexing gives [type, ring] buildings as in
+    building_data.json, and pack() gives city_io's columnar arrays.
+    """
+
+    __slots__ = ('_types', '_centres', '_widths', '_heights', '_rotations', '_bboxes', '_corners', 'size',
+                 '_tree', '_indexed')
+
+    def __init__(self, capacity=16):
+        self._types = np.empty(capacity, dtype=np.uint8)
+        self._centres = np.empty((capacity, 2))
+        self._widths = np.empty(capacity)
+        self._heights = np.empty(capacity)
+        self._rotations = np.empty(capacity)
+        self._bboxes = np.empty((capacity, 4))
+        self._corners = np.empty((capacity, 4, 2))
+        self.size = 0
+        self._tree = None
+        self._indexed = 0
+
+    def __getstate__(self):
+        return (self.types, self.centres, self.widths, self.heights, self.rotations, self.bboxes)
+
+    def __setstate__(self, state):
+        self._types, self._centres, self._widths, self._heights, self._rotations, self._bboxes = (np.array(a) for a in state)
+        self._corners = rectangle_corners(self._centres, self._widths, self._heights, self._rotations)
+        self.size = len(self._types)
+        self._tree = None
+        self._indexed = 0
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        One store holding the buildings of every store in turn.
+        """
+        store = cls(0)
+        if stores:
+            store.__setstate__([np.concatenate(columns) for columns in zip(*(s.__getstate__() for s in stores))])
+        return store
+
+    types = property(lambda self: self._types[:self.size])
+    centres = property(lambda self: self._centres[:self.size])
+    widths = property(lambda self: self._widths[:self.size])
+    heights = property(lambda self: self._heights[:self.size])
+    rotations = property(lambda self: self._rotations[:self.size])
+    bboxes = property(lambda self: self._bboxes[:self.size])
+
+    def __len__(self):
+        return self.size
+
+    def add(self, building_type, centre, width, height, rotation):
+        if self.size == len(self._types):
+            # double the capacity, as a list would
+            capacity = max(2 * self.size, 16)
+            for name in ('_types', '_centres', '_widths', '_heights', '_rotations', '_bboxes', '_corners'):
+                old = getattr(self, name)
+                grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                grown[:self.size] = old[:self.size]
+                setattr(self, name, grown)
+        k = self.size
+        self._types[k] = BUILDING_TYPES.index(building_type)
+        self._centres[k] = centre
+        self._widths[k] = width
+        self._heights[k] = height
+        self._rotations[k] = rotation
+        corners = rectangle_corners(self._centres[k:k + 1], self._widths[k:k + 1], self._heights[k:k + 1], self._rotations[k:k + 1])
+        self._corners[k] = corners[0]
+        self._bboxes[k, :2] = corners[0].min(axis=0)
+        self._bboxes[k, 2:] = corners[0].max(axis=0)
+        self.size += 1
+        return k
+
+    def corners(self, index=slice(None)):
+        """
+        (n, 4, 2) corners of the selected buildings.
+        """
+        return self._corners[:self.size][index]
+
+    def footprints(self, index=slice(None)):
+        return shapely.polygons(self.corners(index))
+
+    def box_hits(self, bounds):
+        """
+        (query, building) index pairs of the stored bounding boxes that
+        overlap each of the (k, 4) minx, miny, maxx, maxy bounds.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        if self.size - self._indexed > INDEX_LAG:
+            self._tree = shapely.STRtree(shapely.box(*self._bboxes[:self.size].T))
+            self._indexed = self.size
+        rows = cols = np.empty(0, dtype=np.intp)
+        if self._tree is not None and len(bounds):
+            rows, cols = self._tree.query(shapely.box(*bounds.T))
+        # buildings added since the tree was built are checked directly
+        boxes = self._bboxes[self._indexed:self.size]
+        recent_rows, recent_cols = np.nonzero((boxes[:, 0] <= bounds[:, 2:3]) & (boxes[:, 2] >= bounds[:, 0:1]) &
+                                              (boxes[:, 1] <= bounds[:, 3:4]) & (boxes[:, 3] >= bounds[:, 1:2]))
+        return np.concatenate([rows, recent_rows]), np.concatenate([cols, recent_cols + self._indexed])
+
+    def collides(self, corners):
+        """
+        True for each of the (k, 4, 2) candidate rectangles that overlaps or
+        touches a stored building. Pairs whose bounding boxes overlap are
+        settled exactly by a separating axis test, all in one batch.
+        """
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        rows, cols = self.box_hits(np.c_[corners.min(axis=1), corners.max(axis=1)])
+        a, b = corners[rows], self._corners[cols]
+        # the edge directions of two rectangles are the only candidate axes
+        axes = np.stack([a[:, 1] - a[:, 0], a[:, 3] - a[:, 0], b[:, 1] - b[:, 0], b[:, 3] - b[:, 0]], 1)
+        pa = np.einsum('pvc,pac->pva', a, axes)
+        pb = np.einsum('pvc,pac->pva', b, axes)
+        separated = (pa.max(axis=1) < pb.min(axis=1)) | (pb.max(axis=1) < pa.min(axis=1))
+        return np.bincount(rows[~separated.any(axis=1)], minlength=len(corners)) > 0
+
+    def intersects(self, geom):
+        """
+        True if geom, any shapely geometry, intersects a stored footprint.
+        """
+        _, candidates = self.box_hits(geom.bounds)
+        return len(candidates) > 0 and bool(shapely.intersects(geom, self.footprints(candidates)).any())
+
+    def rings(self):
+        """
+        (n, 5, 2) closed footprint rings.
+        """
+        corners = self.corners()
+        return np.concatenate([corners, corners[:, :1]], axis=1)
+
+    def __getitem__(self, k):
+        k = range(self.size)[k]
+        corners = self.corners(slice(k, k + 1))[0]
+        ring = np.vstack([corners, corners[:1]])
+        return [BUILDING_TYPES[self.types[k]], [tuple(xy) for xy in ring.tolist()]]
+
+    def __iter__(self):
+        for code, ring in zip(self.types, self.rings().tolist()):
+            yield [BUILDING_TYPES[code], [tuple(xy) for xy in ring]]
+
+    def pack(self):
+        """
+        Same arrays as city_io.pack_buildings, without building any lists.
+        """
+        return {'types': self.types.copy(), 'offsets': np.arange(0, 5 * self.size + 1, 5, dtype=np.int64),
+                'vertices': self.rings().reshape(-1, 2).astype(np.float32)}
+
+def rectangle_corners(centres, widths, heights, rotations):
+    """
+    (k, 4, 2) corners of rectangles given by centre, width, height and
+    rotation about the centre, starting from the corner at (-w/2, -h/2)
+    before rotation and going anticlockwise.
+    """
+    half = np.stack([widths, heights], -1)[:, None, :] / 2 * np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+    cos, sin = np.cos(rotations)[:, None], np.sin(rotations)[:, None]
+    x = cos * half[..., 0] - sin * half[..., 1]
+    y = sin * half[..., 0] + cos * half[..., 1]
+    return np.stack([x + centres[:, None, 0], y + centres[:, None, 1]], -1)
+
+def sample_rectangles(bounds, dimensions, k, rng=np.random, centres=None):
+    """
+    Draws k random rectangles in one go. Each has its origin corner uniform
+    in bounds, width and height uniform in dimensions and is rotated by
+    0-90 degrees about its origin; given an (m, 2) centres array, one
+    rectangle is centred on each point instead.
+    Returns their centres (k, 2), widths, heights and rotations (radians);
+    rectangle_corners gives the corners.
+    """
+    if centres is not None:
+        k = len(centres)
+    else:
+        minx, miny, maxx, maxy = bounds
+        x = rng.uniform(minx, maxx, k)
+        y = rng.uniform(miny, maxy, k)
+    width = rng.uniform(*dimensions, k)
+    height = rng.uniform(*dimensions, k)
+    theta = np.radians(rng.uniform(0, 90, k))
+    if centres is not None:
+        return centres, width, height, theta
+    # the centre is the far corner's midpoint, rotated about the origin corner
+    cos, sin = np.cos(theta), np.sin(theta)
+    centres = np.stack([x + (cos * width - sin * height) / 2, y + (sin * width + cos * height) / 2], -1)
+    return centres, width, height, theta
+
+def prefilter_rectangles(corners, blob):
+    """
+    Cheap vectorised rejection before any shapely objects are built: keeps
+    rectangles whose corners all lie within the blob's bounding box and
+    inside the (prepared) blob itself.
+    Returns the mask of surviving candidates.
+    """
+    minx, miny, maxx, maxy = blob.bounds
+    xs, ys = corners[..., 0], corners[..., 1]
+    keep = np.all((xs >= minx) & (xs <= maxx) & (ys >= miny) & (ys <= maxy), axis=1)
+    inside = shapely.contains_xy(blob, xs[keep].ravel(), ys[keep].ravel())
+    keep[keep] = inside.reshape(-1, 4).all(axis=1)
+    return keep
+
+
+class OccupancyRaster:
+    """
+    Raster of the free space left in a blob: cells whose centre is inside
+    the blob and outside the buffered roads, and that no building touches.
+    Candidate centres are drawn only from cells with enough free space
+    around them for the building type's shortest side, and candidate
+    footprints are checked against the raster before any shapely work, so
+    most candidates that reach shapely fit.
+    """
+
+    def __init__(self, blob, road_network, cell_size=1.0, road_width=1.0):
+        self.cell_size = cell_size
+        minx, miny, maxx, maxy = blob.bounds
+        self.origin = np.array([minx, miny])
+        nCols = max(int(np.ceil((maxx - minx) / cell_size)), 1)
+        nRows = max(int(np.ceil((maxy - miny) / cell_size)), 1)
+        self.shape = (nRows, nCols)
+        cx, cy = self._centres(0, nRows, 0, nCols)
+        free = shapely.contains_xy(blob, cx, cy)
+        # only cells inside the blob need the (slower) road distance test
+        free[free] = ~shapely.dwithin(road_network, shapely.points(cx[free], cy[free]), road_width / 2)
+        self.free = free.reshape(self.shape)
+        # cells footprints must not reach: outside the blob, on a road or
+        # wholly inside a building
+        self._bordered = np.ones((nRows + 2, nCols + 2), dtype=bool)
+        self.blocked = self._bordered[1:-1, 1:-1]
+        self.blocked[:] = ~self.free
+        # free masks eroded by a disc of each radius asked for, in cells,
+        # and (possibly stale) lists of their free cells
+        self._clear = {}
+        self._cells = {}
+        # unit grids of n x n points that fits spreads over footprints
+        self._spreads = {}
+
+    def _centres(self, r0, r1, c0, c1):
+        cols = self.origin[0] + (np.arange(c0, c1) + 0.5) * self.cell_size
+        rows = self.origin[1] + (np.arange(r0, r1) + 0.5) * self.cell_size
+        cx, cy = np.meshgrid(cols, rows)
+        return cx.ravel(), cy.ravel()
+
+    @property
+    def free_fraction(self):
+        return self.free.mean()
+
+    def sample_centres(self, k, min_side, rng=np.random):
+        """
+        Up to k points drawn uniformly from the cells with free space at
+        least min_side / 2 all around, or None if there are none.
+        """
+        radius = int(min_side / 2 / self.cell_size)
+        if radius not in self._clear:
+            # radius 0 is the free mask itself, kept up to date by mark
+            self._clear[radius] = erode(self.free, radius) if radius else self.free
+        if radius not in self._cells:
+            self._cells[radius] = np.flatnonzero(self._clear[radius])
+        cells = self._cells[radius]
+        if len(cells) == 0:
+            return None
+        # uniform() works for both np.random and a Generator
+        picked = cells[np.minimum(rng.uniform(0, len(cells), k).astype(int), len(cells) - 1)]
+        # the cell list goes stale as buildings are marked; picks no longer
+        # clear are dropped and the list is rebuilt once half of them are
+        clear = self._clear[radius].ravel()[picked]
+        if clear.mean() < 0.5:
+            del self._cells[radius]
+        rows, cols = np.divmod(picked[clear], self.shape[1])
+        jitter = rng.uniform(0, 1, (len(rows), 2))
+        return self.origin + (np.stack([cols, rows], -1) + jitter) * self.cell_size
+
+    def fits(self, corners):
+        """
+        False for each of the (k, 4, 2) rectangles with a point on a blocked
+        cell or off the raster, judged at points spread over the footprint
+        no more than a cell apart. A 3 x 3 spread is tried first, so only
+        the rectangles passing it are looked at closely.
+        """
+        if len(corners) == 0:
+            return np.zeros(0, dtype=bool)
+        across = corners[:, 1] - corners[:, 0]
+        up = corners[:, 3] - corners[:, 0]
+        longest = np.sqrt(max(np.einsum('ij,ij->i', across, across).max(), np.einsum('ij,ij->i', up, up).max()))
+        fits = self._clear_at(corners[:, 0], across, up, 3)
+        n = int(np.ceil(longest / self.cell_size)) + 1
+        if n > 3 and fits.any():
+            fits[fits] = self._clear_at(corners[fits, 0], across[fits], up[fits], n)
+        return fits
+
+    def _clear_at(self, start, across, up, n):
+        if n not in self._spreads:
+            self._spreads[n] = [grid.ravel() for grid in np.meshgrid(np.linspace(0, 1, n), np.linspace(0, 1, n))]
+        s, t = self._spreads[n]
+        # in cells from the corner of the blocked border, onto which anything
+        # off the raster is clipped
+        start = (start - self.origin) / self.cell_size + 1
+        across, up = across / self.cell_size, up / self.cell_size
+        x = np.clip(start[:, :1] + s * across[:, :1] + t * up[:, :1], 0, self.shape[1] + 1).astype(np.intp)
+        y = np.clip(start[:, 1:] + s * across[:, 1:] + t * up[:, 1:], 0, self.shape[0] + 1).astype(np.intp)
+        return ~self._bordered[y, x].any(axis=1)
+
+    def mark(self, centre, width, height, rotation):
+        """
+        Marks every cell a placed rectangle touches as occupied, and those
+        it covers as blocked.
+        """
+        cos, sin = np.cos(rotation), np.sin(rotation)
+        extent = np.array([abs(cos) * width + abs(sin) * height, abs(sin) * width + abs(cos) * height]) / 2
+        c0, r0 = np.floor((centre - extent - self.origin) / self.cell_size).astype(int)
+        c1, r1 = np.floor((centre + extent - self.origin) / self.cell_size).astype(int) + 1
+        r0, c0 = max(r0, 0), max(c0, 0)
+        r1, c1 = min(r1, self.shape[0]), min(c1, self.shape[1])
+        if r0 >= r1 or c0 >= c1:
+            return
+        cx, cy = self._centres(r0, r1, c0, c1)
+        half = self.cell_size / 2
+        # cell centres in the rectangle's frame, and the cell's half extent
+        # along each of its axes
+        dx, dy = cx - centre[0], cy - centre[1]
+        u, v = np.abs(cos * dx + sin * dy), np.abs(cos * dy - sin * dx)
+        reach = half * (abs(cos) + abs(sin))
+        # separating axes: the grid axes (covered by the window) and the
+        # rectangle's own
+        touched = (u <= width / 2 + reach) & (v <= height / 2 + reach)
+        covered = (u <= width / 2 - reach) & (v <= height / 2 - reach)
+        self.free[r0:r1, c0:c1] &= ~touched.reshape(r1 - r0, c1 - c0)
+        self.blocked[r0:r1, c0:c1] |= covered.reshape(r1 - r0, c1 - c0)
+        # only cells within the radius of the change can erode further,
+        # which needs the free cells up to twice the radius away
+        for radius, clear in self._clear.items():
+            if radius == 0:
+                continue
+            a0, a1 = max(r0 - 2*radius, 0), min(r1 + 2*radius, self.shape[0])
+            b0, b1 = max(c0 - 2*radius, 0), min(c1 + 2*radius, self.shape[1])
+            e0, e1 = max(r0 - radius, 0), min(r1 + radius, self.shape[0])
+            f0, f1 = max(c0 - radius, 0), min(c1 + radius, self.shape[1])
+            clear[e0:e1, f0:f1] = erode(self.free[a0:a1, b0:b1], radius)[e0 - a0:e1 - a0, f0 - b0:f1 - b0]
+
+def erode(mask, radius):
+    """
+    Cells of the boolean mask whose whole disc of radius cells lies in the
+    mask, counting cells off the edge as outside it.
+    """
+    rows, cols = mask.shape
+    padded = np.zeros((rows + 2*radius, cols + 2*radius), dtype=bool)
+    padded[radius:radius + rows, radius:radius + cols] = mask
+    eroded = mask.copy()
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx*dx + dy*dy <= radius*radius:
+                eroded &= padded[radius + dy:radius + dy + rows, radius + dx:radius + dx + cols]
+    return eroded
+
+def street_blocks(blob, road_network, road_width=1.0):
+    """
+    Splits a blob into the street blocks enclosed by its road grid and its
+    outline, each inset by half the road width from the road centrelines.
+    Returns an array of polygons; blocks too thin to survive the inset are
+    dropped. Blocks are disjoint, so each can be filled on its own.
+    """
+    lines = shapely.get_parts(shapely.union_all([road_network, blob.exterior]))
+    faces = shapely.get_parts(shapely.polygonize(lines))
+    # the grid is clipped to the blob, but concave outlines can close faces outside it
+    faces = faces[shapely.contains(blob, shapely.point_on_surface(faces))]
+    blocks = shapely.get_parts(shapely.buffer(faces, -road_width / 2, join_style='mitre'))
+    # polygonize drops dead-end roads, so cut them out of the blocks they run into
+    shapely.prepare(road_network)
+    crossed = np.flatnonzero(shapely.intersects(road_network, blocks))
+    for k in crossed:
+        dead_ends = road_network.intersection(blocks[k].buffer(road_width))
+        blocks[k] = blocks[k].difference(dead_ends.buffer(road_width / 2))
+    if len(crossed):
+        blocks = shapely.get_parts(blocks)
+    return blocks[~shapely.is_empty(blocks)]
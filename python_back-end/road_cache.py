@@ -0,0 +1,89 @@
+# road_cache
+# Content-addressed cache of Blob2Graph results, keyed on the blob outline
+# and target pitch, with an in-memory LRU tier and an optional on-disk tier.
+
+from collections import OrderedDict
+import hashlib
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from Blob2Graph import GRID_VERSION
+
+
+def road_key(borderArray, L):
+    """
+    Hash of the outline coordinates, target pitch and Blob2Graph's
+    GRID_VERSION.
+    """
+    coords = np.ascontiguousarray(borderArray, dtype=np.float64)
+    digest = hashlib.sha1(coords.tobytes())
+    digest.update(repr(coords.shape).encode())
+    digest.update(repr(float(L)).encode())
+    digest.update(f'grid-v{GRID_VERSION}'.encode())
+    return digest.hexdigest()
+
+
+class RoadCache:
+    """
+    Stores road grids as {'Junctions', 'Roads', 'Pitch'} dicts. Pitch is
+    informational only: it is the target pitch (the blob's density) the
+    grid was requested with, not the spacing Blob2Graph ended up using, and
+    nothing reads it back to rebuild a grid. The newest `maxsize` entries are kept
+    in memory; if `directory` is given every entry is also written there as
+    an .npz file and survives between runs and processes.
+    """
+
+    def __init__(self, maxsize=128, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # worker processes get the disk tier only, not a copy of the memory
+        return {'maxsize': self.maxsize, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, borderArray, L):
+        """
+        Cached road grid for this outline and pitch, or None.
+        """
+        key = road_key(borderArray, L)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        with np.load(self._path(key)) as data:
+            roads = csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+            entry = {'Junctions': data['junctions'], 'Roads': roads, 'Pitch': float(data['pitch'])}
+        self._remember(key, entry)
+        return entry
+
+    def put(self, borderArray, L, entry):
+        """
+        Stores a road grid dict for this outline and pitch.
+        """
+        key = road_key(borderArray, L)
+        self._remember(key, entry)
+        if self.directory is not None:
+            roads = csr_matrix(entry['Roads'])
+            # write then rename, so a concurrent reader never sees half a file
+            tmp = self._path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez(f, junctions=entry['Junctions'], data=roads.data,
+                         indices=roads.indices, indptr=roads.indptr, shape=roads.shape,
+                         pitch=entry['Pitch'])
+            os.replace(tmp, self._path(key))
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
@@ -0,0 +1,217 @@
+# road_graph
+# Road network as a first-class graph: junction coordinates, edge index
+# pairs and a CSR adjacency weighted by edge length, with batched routing
+# and distance queries. A networkx view is available when it is installed.
+# Per-blob graphs can be merged into one citywide network.
+
+import numpy as np
+import shapely
+from scipy.sparse import coo_matrix, triu
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+
+class RoadGraph:
+    """
+    Undirected road graph. junctions is (N, 2), edges is (E, 2) junction
+    index pairs with i < j, lengths is (E,) and adjacency is the symmetric
+    N x N CSR matrix of edge lengths.
+    """
+
+    def __init__(self, junctions, edges):
+        self.junctions = np.asarray(junctions, dtype=np.float64).reshape(-1, 2)
+        edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        self.edges = np.unique(edges, axis=0)
+        self.lengths = np.linalg.norm(self.junctions[self.edges[:, 1]] - self.junctions[self.edges[:, 0]], axis=1)
+        n = len(self.junctions)
+        # csgraph drops explicit zeros, so keep coincident junctions joined
+        weights = np.maximum(self.lengths, 1e-12)
+        i, j = self.edges.T
+        self.adjacency = coo_matrix((np.concatenate([weights, weights]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                                    shape=(n, n)).tocsr()
+        self._segments = None
+        self._kdtree = None
+
+    @classmethod
+    def from_road_data(cls, road_data):
+        """
+        Graph from a {'Junctions', 'Roads'} dict as made by Blob2Graph.
+        """
+        return cls(road_data['Junctions'], np.column_stack(triu(road_data['Roads']).nonzero()))
+
+    @classmethod
+    def from_result(cls, result):
+        """
+        Graph from a citygen.generate_blob result.
+        """
+        return cls(result['Junctions'], result['Edges'])
+
+    def __len__(self):
+        return len(self.junctions)
+
+    @property
+    def num_edges(self):
+        return len(self.edges)
+
+    def segments(self):
+        """
+        (E, 2, 2) array of road segment end points.
+        """
+        return self.junctions[self.edges]
+
+    def to_networkx(self):
+        """
+        networkx.Graph view with 'pos' node and 'length' edge attributes.
+        """
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from((k, {'pos': tuple(p)}) for k, p in enumerate(self.junctions))
+        graph.add_weighted_edges_from(((int(i), int(j), float(w)) for (i, j), w in zip(self.edges, self.lengths)),
+                                      weight='length')
+        return graph
+
+    def components(self):
+        """
+        Number of connected components and the component label of every
+        junction.
+        """
+        return connected_components(self.adjacency, directed=False)
+
+    def shortest_distances(self, sources, targets=None):
+        """
+        Road distances from each junction in sources to every junction, or
+        to targets only, as a (len(sources), N or len(targets)) array.
+        Unreachable junctions are inf.
+        """
+        distances = dijkstra(self.adjacency, directed=False, indices=np.atleast_1d(sources))
+        return distances if targets is None else distances[:, np.atleast_1d(targets)]
+
+    def shortest_path(self, source, target):
+        """
+        Junction indices along the shortest road path from source to target,
+        or an empty list if they are not connected.
+        """
+        _, predecessors = dijkstra(self.adjacency, directed=False, indices=source, return_predecessors=True)
+        if target != source and predecessors[target] < 0:
+            return []
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessors[path[-1]])
+        return [int(k) for k in path[::-1]]
+
+    def nearest_junction(self, points):
+        """
+        Straight-line distance to, and index of, the nearest junction for
+        each of the (M, 2) points.
+        """
+        if self._kdtree is None:
+            self._kdtree = cKDTree(self.junctions)
+        return self._kdtree.query(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+
+    def distance_to_road(self, points):
+        """
+        Distance from each of the (M, 2) points to the nearest road segment,
+        answered in one batched STRtree query.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.num_edges == 0:
+            return np.full(len(points), np.inf)
+        if self._segments is None:
+            self._segments = shapely.STRtree(shapely.linestrings(self.segments()))
+        (point_idx, _), distances = self._segments.query_nearest(shapely.points(points), return_distance=True,
+                                                                  all_matches=False)
+        result = np.full(len(points), np.inf)
+        result[point_idx] = distances
+        return result
+
+
+def building_centres(building_data):
+    """
+    Centre of each [type, ring] building (mean of its corners).
+    """
+    if not building_data:
+        return np.empty((0, 2))
+    # rings are closed, so drop the repeated first corner
+    return np.array([np.mean(np.asarray(coords)[:-1], axis=0) for _, coords in building_data])
+
+def road_access(graph, building_data):
+    """
+    Distance from every building centre to its nearest road.
+    """
+    return graph.distance_to_road(building_centres(building_data))
+
+def border_roads(junctions, outlines, tolerance=0.5):
+    """
+    Roads along the blob outlines, which Blob2Graph leaves out. Each outline
+    becomes a chain through its own vertices and every one of junctions
+    within tolerance of it, in order along the outline, so blobs sharing a
+    border share the junctions on it.
+    Returns the outline vertices, the blob each belongs to and the (E, 2)
+    border edges, numbering the vertices after junctions.
+    """
+    rings = [np.asarray(outline, dtype=np.float64).reshape(-1, 2) for outline in outlines]
+    rings = [ring[:-1] if len(ring) > 1 and np.array_equal(ring[0], ring[-1]) else ring for ring in rings]
+    vertices = np.vstack(rings + [np.empty((0, 2))])
+    vertex_blob = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+    lines = shapely.linearrings(vertices, indices=vertex_blob) if len(vertices) else np.empty(0, dtype=object)
+    points = shapely.points(np.vstack([junctions, vertices]))
+    line, point = shapely.STRtree(points).query(lines, predicate='dwithin', distance=tolerance)
+    if len(line) == 0:
+        return vertices, vertex_blob, np.empty((0, 2), dtype=np.int64)
+    position = shapely.line_locate_point(lines[line], points[point])
+    order = np.lexsort((position, line))
+    line, point = line[order], point[order]
+    # consecutive points along each outline, plus the one closing the ring
+    same = line[1:] == line[:-1]
+    first = np.flatnonzero(np.r_[True, ~same])
+    last = np.r_[first[1:], len(line)] - 1
+    edges = np.vstack([np.c_[point[:-1], point[1:]][same], np.c_[point[last], point[first]]])
+    return vertices, vertex_blob, edges
+
+def merge_road_graphs(graphs, tolerance=0.5, outlines=None, exclusions=None):
+    """
+    Joins per-blob road graphs into one citywide graph. With outlines (each
+    blob's outerPolygon, in the order of graphs) the blob borders are added
+    as roads (see border_roads), leaving out any that enter a river or park
+    of exclusions, so blobs sharing a border are connected along it.
+    Junctions from different blobs that lie within tolerance of each other
+    are snapped together at their mean position, then the edges are
+    renumbered and deduplicated.
+    Returns the merged RoadGraph and, for every input junction in order,
+    its index in the merged graph.
+    """
+    junctions = np.vstack([g.junctions for g in graphs]) if graphs else np.empty((0, 2))
+    offsets = np.cumsum([0] + [len(g) for g in graphs])
+    blob = np.repeat(np.arange(len(graphs)), np.diff(offsets))
+    edges = np.vstack([g.edges + offset for g, offset in zip(graphs, offsets)]) if graphs else np.empty((0, 2), dtype=np.int64)
+    inputs = len(junctions)
+    if outlines is not None:
+        vertices, vertex_blob, border = border_roads(junctions, outlines, tolerance)
+        junctions = np.vstack([junctions, vertices])
+        blob = np.concatenate([blob, vertex_blob])
+        if exclusions is not None:
+            border = border[~exclusions.blocked_segments(junctions[border])]
+        edges = np.vstack([edges, border])
+    n = len(junctions)
+    # candidate snaps, kept only between different blobs
+    pairs = cKDTree(junctions).query_pairs(tolerance, output_type='ndarray') if n else np.empty((0, 2), dtype=np.int64)
+    pairs = pairs[blob[pairs[:, 0]] != blob[pairs[:, 1]]]
+    snap = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    count, labels = connected_components(snap, directed=False)
+    # each cluster moves to the mean of its junctions
+    sizes = np.bincount(labels, minlength=count)
+    merged = np.column_stack([np.bincount(labels, junctions[:, k], minlength=count) for k in range(2)]) / sizes[:, None]
+    edges = labels[edges]
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    return RoadGraph(merged, edges), labels[:inputs]
+
+def city_road_graph(results, blobs, tolerance=0.5, exclusions=None):
+    """
+    Citywide road graph from the results of citygen.generate_city and the
+    blobs they were generated from (citygen.buildable_blobs), joined along
+    the blob borders.
+    """
+    graphs = [RoadGraph.from_result(result) for result in results]
+    outlines = [blob["outerPolygon"] for blob in blobs]
+    graph, _ = merge_road_graphs(graphs, tolerance, outlines, exclusions)
+    return graph
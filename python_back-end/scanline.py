@@ -0,0 +1,107 @@
+# scanline
+# Intersects every row and column of a regular grid with the polygon edges
+# in one vectorised sweep, and joins the boundary junctions this produces to
+# the grid by index arithmetic.
+
+import numpy as np
+
+
+def polygon_edges(polygon):
+    """
+    Returns the start and end points of every edge of the polygon's
+    exterior and interior rings as two (E, 2) arrays.
+    """
+    starts = []
+    ends = []
+    for ring in [polygon.exterior, *polygon.interiors]:
+        coords = np.asarray(ring.coords)[:, :2]
+        starts.append(coords[:-1])
+        ends.append(coords[1:])
+    return np.vstack(starts), np.vstack(ends)
+
+def line_crossings(starts, ends, values, axis):
+    """
+    Finds where the scanlines {axis == v for v in values} cross the edges.
+    Each edge covers the half-open range [min, max) along axis so a line
+    through a vertex is counted once per ring passage, and edges parallel
+    to the scanlines are skipped.
+    Returns the line index and the crossing position along the other axis.
+    """
+    other = 1 - axis
+    a = starts[:, axis]
+    b = ends[:, axis]
+    lo = np.searchsorted(values, np.minimum(a, b), side='left')
+    hi = np.searchsorted(values, np.maximum(a, b), side='left')
+    counts = np.maximum(hi - lo, 0)
+    # one entry per (edge, line) crossing
+    edge = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.cumsum(counts) - counts
+    line = lo[edge] + np.arange(counts.sum()) - offsets[edge]
+    t = (values[line] - a[edge]) / (b[edge] - a[edge])
+    pos = starts[edge, other] + t * (ends[edge, other] - starts[edge, other])
+    return line, pos
+
+def scanline_segments(polygon, values, axis):
+    """
+    Returns the interior segments of the scanlines {axis == v}, as
+    (line index, start, end) arrays sorted by line and then position.
+    Crossings along a line are paired with the even-odd rule, so a line that
+    enters and leaves the polygon several times gives one segment per pass.
+    """
+    starts, ends = polygon_edges(polygon)
+    line, pos = line_crossings(starts, ends, values, axis)
+    order = np.lexsort((pos, line))
+    line = line[order]
+    pos = pos[order]
+    # a closed ring is crossed an even number of times by every line
+    seg_line = line[0::2]
+    seg_lo = pos[0::2]
+    seg_hi = pos[1::2]
+    # lines that only touch a vertex give (up to rounding) zero length segments
+    extent = np.ptp(np.vstack([starts, ends]), axis=0).max()
+    keep = seg_hi - seg_lo > 1e-9 * extent
+    return seg_line[keep], seg_lo[keep], seg_hi[keep]
+
+def segment_junctions(polygon, values, grid_values, node_id, axis):
+    """
+    Boundary junctions for the scanlines {axis == v}. node_id is the
+    (nRows, nCols) map from grid position to junction index (-1 outside).
+    Returns the junction coordinates, two per segment, and the index of the
+    interior grid junction each one connects to. Segments with no interior
+    grid point get no junctions, so any pitch gives a valid graph.
+    """
+    line, lo, hi = scanline_segments(polygon, values, axis)
+    # first and last grid position strictly inside each segment
+    first = np.searchsorted(grid_values, lo, side='right')
+    last = np.searchsorted(grid_values, hi, side='left') - 1
+    # segments crossing a sliver too thin to hold a grid point are dropped
+    keep = first <= last
+    line, lo, hi, first, last = line[keep], lo[keep], hi[keep], first[keep], last[keep]
+    if axis == 0:
+        # columns: line indexes x, grid_values are the rows
+        first_id = node_id[first, line]
+        last_id = node_id[last, line]
+    else:
+        first_id = node_id[line, first]
+        last_id = node_id[line, last]
+    # as are the rare ones whose end grid point sits on the boundary
+    keep = (first_id >= 0) & (last_id >= 0)
+    line, lo, hi, first_id, last_id = line[keep], lo[keep], hi[keep], first_id[keep], last_id[keep]
+    nodes = np.empty((2 * len(line), 2))
+    nodes[0::2, axis] = values[line]
+    nodes[1::2, axis] = values[line]
+    nodes[0::2, 1 - axis] = lo
+    nodes[1::2, 1 - axis] = hi
+    attach = np.empty(2 * len(line), dtype=int)
+    attach[0::2] = first_id
+    attach[1::2] = last_id
+    return nodes, attach
+
+def boundary_junctions(polygon, x_values, y_values, node_id):
+    """
+    Boundary junctions where every grid column and then every grid row meet
+    the polygon edge, with the interior junction each one connects to.
+    """
+    col_nodes, col_attach = segment_junctions(polygon, x_values, y_values, node_id, 0)
+    row_nodes, row_attach = segment_junctions(polygon, y_values, x_values, node_id, 1)
+    return np.vstack([col_nodes, row_nodes]), np.concatenate([col_attach, row_attach])
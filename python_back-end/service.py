@@ -0,0 +1,284 @@
+# service
+# Local HTTP service so the front end can request city generation on demand.
+# Jobs are queued, run blob by blob in a shared process pool off the event
+# loop, and their progress and per-blob results are streamed back as NDJSON.
+#
+#   POST /jobs               {"cityShapes": [...], "seed": 0, "mode": "uniform",
+#                             "rivers": [[centreline, width], ...]}
+#                            -> {"job": id, "status": ...}
+#   GET  /jobs/<id>          -> status and progress
+#   GET  /jobs/<id>/stream   -> NDJSON: a progress line per finished blob with
+#                               its roads and buildings, then a final line
+#
+#   python service.py [--host 127.0.0.1] [--port 8765] [--workers N] [--max-jobs 2]
+
+import argparse
+import asyncio
+from collections import OrderedDict
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import hashlib
+import json
+import numpy as np
+import citygen
+from city_io import blob_record, repair_shape
+from exclusions import ExclusionMask
+
+STATUS_TEXT = {200: 'OK', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request',
+               404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+# largest request body accepted, in bytes
+MAX_BODY = 64 * 2**20
+
+
+class RequestTooLarge(ValueError):
+    """
+    Raised by read_request for a body over MAX_BODY.
+    """
+
+
+class Job:
+    """
+    One generation request. events holds the NDJSON lines produced so far;
+    streamers wait on `changed` for more until the final event is in.
+    """
+
+    def __init__(self, job_id, payload):
+        self.id = job_id
+        self.payload = payload
+        self.status = 'queued'
+        self.total = 0
+        self.done = 0
+        self.error = None
+        self.events = []
+        self.finished = False
+        self.changed = asyncio.Condition()
+
+    def info(self):
+        info = {'job': self.id, 'status': self.status, 'blobs': self.total, 'done': self.done}
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+    async def publish(self, event=None, final=False):
+        async with self.changed:
+            if event is not None:
+                self.events.append(json.dumps(event) + '\n')
+            self.finished = final
+            self.changed.notify_all()
+
+
+class CityService:
+    """
+    Job queue in front of a process pool. Identical payloads submitted
+    while a job for them is queued or running share that job; at most
+    max_jobs jobs generate at once, and the newest `keep` finished jobs are
+    kept for later status and stream requests.
+    """
+
+    def __init__(self, workers=None, max_jobs=2, keep=100, cache=None):
+        # forked workers would inherit the open client sockets and keep
+        # connections from closing, so start them fresh
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.slots = asyncio.Semaphore(max_jobs)
+        self.keep = keep
+        self.cache = cache
+        self.jobs = OrderedDict()
+        self.in_flight = {}
+        self.numbers = itertools.count()
+        # the loop only keeps weak references to tasks
+        self.tasks = set()
+
+    def submit(self, payload):
+        """
+        Queues a payload, or returns the in-flight job for an identical one.
+        """
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        if key in self.in_flight:
+            return self.in_flight[key]
+        job = Job(f'{next(self.numbers)}-{key[:12]}', payload)
+        self.jobs[job.id] = job
+        self.in_flight[key] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(lambda task: self._finish(key, task))
+        return job
+
+    def _finish(self, key, task):
+        self.tasks.discard(task)
+        self.in_flight.pop(key, None)
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            job.status = 'running'
+            try:
+                exclusions, blobs = await loop.run_in_executor(self.pool, prepare_city, job.payload)
+                job.total = len(blobs)
+                await job.publish()
+                # same seeds as citygen.generate_city with this seed
+                seeds = np.random.SeedSequence(job.payload.get('seed')).spawn(len(blobs))
+                mode = job.payload.get('mode', 'uniform')
+
+                async def generate(index, blob, seed):
+                    # the cache lives in this process; workers get hits and return new grids
+                    road_data = self.cache.get(*citygen.grid_key(blob)) if self.cache is not None else None
+                    result = await loop.run_in_executor(self.pool, citygen.generate_blob, blob, seed, mode, None,
+                                                        exclusions, road_data)
+                    built = result.pop('Grid', None)
+                    if self.cache is not None and built is not None:
+                        self.cache.put(*citygen.grid_key(blob), built)
+                    return index, result
+
+                tasks = [asyncio.ensure_future(generate(index, blob, seed))
+                         for index, (blob, seed) in enumerate(zip(blobs, seeds))]
+                try:
+                    for task in asyncio.as_completed(tasks):
+                        index, result = await task
+                        job.done += 1
+                        await job.publish({'type': 'blob', 'done': job.done, 'blobs': job.total,
+                                           **blob_record(index, blobs[index], result)})
+                except BaseException:
+                    # stop queueing the rest of this job's blobs and retrieve their errors
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+                job.status = 'done'
+            except Exception as error:
+                job.status = 'failed'
+                job.error = f'{type(error).__name__}: {error}'
+            await job.publish({'type': 'end', **job.info()}, final=True)
+
+    async def handle(self, reader, writer):
+        error = None
+        try:
+            method, path, body = await read_request(reader)
+        except RequestTooLarge:
+            error = 413, {'error': f'request body over {MAX_BODY} bytes'}
+        except (ValueError, asyncio.IncompleteReadError):
+            error = 400, {'error': 'malformed request'}
+        try:
+            if error is not None:
+                await send_json(writer, *error)
+            else:
+                await self.route(method, path, body, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body, writer):
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if method == 'OPTIONS':
+            await send_json(writer, 204, None)
+        elif parts == ['jobs'] and method == 'POST':
+            try:
+                payload = json.loads(body)
+                if not isinstance(payload, dict) or not isinstance(payload.get('cityShapes'), list):
+                    raise ValueError('payload needs a cityShapes list')
+            except ValueError as error:
+                await send_json(writer, 400, {'error': str(error)})
+                return
+            await send_json(writer, 202, self.submit(payload).info())
+        elif len(parts) in (2, 3) and parts[0] == 'jobs' and method == 'GET':
+            job = self.jobs.get(parts[1])
+            if job is None:
+                await send_json(writer, 404, {'error': 'no such job'})
+            elif len(parts) == 2:
+                await send_json(writer, 200, job.info())
+            elif parts[2] == 'stream':
+                await self.stream(job, writer)
+            else:
+                await send_json(writer, 404, {'error': 'not found'})
+        else:
+            await send_json(writer, 404 if method in ('GET', 'POST') else 405, {'error': 'not found'})
+
+    async def stream(self, job, writer):
+        """
+        Sends every event of the job so far, then each new one as it comes,
+        using chunked transfer encoding.
+        """
+        writer.write(response_head(200, 'application/x-ndjson', chunked=True))
+        sent = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda: len(job.events) > sent or job.finished)
+                events = job.events[sent:]
+            for event in events:
+                data = event.encode()
+                writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            sent += len(events)
+            await writer.drain()
+            if job.finished and sent == len(job.events):
+                break
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+
+def prepare_city(payload):
+    """
+    Repairs the payload's shapes and returns its exclusion mask and
+    buildable blobs. Run in the pool, as this is too slow for the loop.
+    """
+    shapes = [repair_shape(shape) for shape in payload['cityShapes']]
+    exclusions = ExclusionMask.from_city(shapes, payload.get('rivers', ()))
+    return exclusions, list(citygen.buildable_blobs(shapes))
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request. Returns method, path and body bytes; a
+    body over MAX_BODY raises RequestTooLarge without being read.
+    """
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) < 2:
+        raise ValueError('bad request line')
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length < 0:
+        raise ValueError('bad content length')
+    if length > MAX_BODY:
+        raise RequestTooLarge(f'body of {length} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return request_line[0].upper(), request_line[1], body
+
+def response_head(status, content_type, length=None, chunked=False):
+    lines = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}', f'Content-Type: {content_type}',
+             'Access-Control-Allow-Origin: *', 'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+             'Access-Control-Allow-Headers: Content-Type', 'Connection: close']
+    if chunked:
+        lines.append('Transfer-Encoding: chunked')
+    else:
+        lines.append(f'Content-Length: {length or 0}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+async def send_json(writer, status, payload):
+    data = b'' if payload is None else json.dumps(payload).encode()
+    writer.write(response_head(status, 'application/json', len(data)) + data)
+    await writer.drain()
+
+async def serve(host='127.0.0.1', port=8765, workers=None, max_jobs=2):
+    service = CityService(workers, max_jobs)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local city generation service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='generation processes (default: all cores)')
+    parser.add_argument('--max-jobs', type=int, default=2, help='jobs generating at once')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers, args.max_jobs))
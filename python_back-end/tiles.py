@@ -0,0 +1,179 @@
+# tiles
+# Quadtree tile pyramid of a generated city for the map viewer. Level z
+# splits the city's bounding square into 2^z x 2^z tiles; each tile file
+# holds only the buildings and roads overlapping it. The finest level has
+# everything at full detail, coarser levels merge and simplify buildings
+# and keep only the longer roads, so a viewer loads a handful of small
+# tiles for whatever zoom it shows.
+#
+#   <directory>/tiles.json       index: origin, size, levels, tile list
+#   <directory>/<z>/<x>/<y>.json {"bounds", "buildings", "roads"}
+#
+#   python tiles.py exportData.txt tiles/ [--seed N] [--levels N]
+
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import shapely
+from city_io import BUILDING_TYPES
+from placement import BuildingStore
+
+MAX_LEVELS = 8
+
+
+def tile_spans(boxes, origin, size):
+    """
+    Every (feature, x, y) pair for the (n, 4) minx, miny, maxx, maxy boxes
+    and the tiles of side `size` they overlap, counted from origin.
+    """
+    lo = np.floor((boxes[:, :2] - origin) / size).astype(np.int64)
+    hi = np.floor((boxes[:, 2:] - origin) / size).astype(np.int64)
+    widths = hi[:, 0] - lo[:, 0] + 1
+    counts = widths * (hi[:, 1] - lo[:, 1] + 1)
+    feature = np.repeat(np.arange(len(boxes)), counts)
+    # position of each pair within its feature's span, row by row
+    rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    x = lo[feature, 0] + rank % widths[feature]
+    y = lo[feature, 1] + rank // widths[feature]
+    return feature, x, y
+
+def group_by_tile(feature, x, y):
+    """
+    Dict mapping (x, y) to the features in that tile.
+    """
+    if len(feature) == 0:
+        return {}
+    order = np.lexsort((feature, y, x))
+    feature, x, y = feature[order], x[order], y[order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(x) != 0) | (np.diff(y) != 0)])
+    ends = np.r_[starts[1:], len(feature)]
+    return {(int(x[s]), int(y[s])): feature[s:e] for s, e in zip(starts, ends)}
+
+def road_line_lengths(segments, blob):
+    """
+    Length of the straight road each (E, 2, 2) segment is part of: the
+    total length of the segments of its blob on the same horizontal or
+    vertical grid line. Segments that are neither (along blob outlines)
+    get inf, so they are always kept.
+    """
+    step = segments[:, 1] - segments[:, 0]
+    lengths = np.linalg.norm(step, axis=1)
+    tolerance = 1e-9 * max(np.abs(segments).max(), 1.0) if len(segments) else 0
+    horizontal = np.abs(step[:, 1]) <= tolerance
+    vertical = np.abs(step[:, 0]) <= tolerance
+    line = np.full(len(segments), np.inf)
+    straight = horizontal | vertical
+    coord = np.where(horizontal, segments[:, 0, 1], segments[:, 0, 0])
+    keys = np.c_[blob, horizontal, np.round(coord, 6)][straight]
+    if len(keys):
+        _, inverse = np.unique(keys, axis=0, return_inverse=True)
+        line[straight] = np.bincount(inverse.ravel(), lengths[straight])[inverse.ravel()]
+    return line
+
+def merge_buildings(codes, footprints, tolerance):
+    """
+    Coarse version of a group of buildings: for each type, footprints
+    closer than tolerance are merged, outlines are simplified to tolerance
+    and parts smaller than tolerance^2 are dropped.
+    """
+    merged = []
+    for code in np.unique(codes):
+        grown = shapely.buffer(footprints[codes == code], tolerance / 2, join_style='mitre')
+        union = shapely.union_all(grown).buffer(-tolerance / 2, join_style='mitre').simplify(tolerance)
+        for part in shapely.get_parts(union):
+            if part.area >= tolerance**2:
+                merged.append([BUILDING_TYPES[code], list(part.exterior.coords)])
+    return merged
+
+def finest_level(centres, origin, side, max_buildings):
+    """
+    Shallowest level at which no tile holds more than max_buildings
+    building centres, at most MAX_LEVELS - 1.
+    """
+    for z in range(MAX_LEVELS):
+        cells = np.floor((centres - origin) / (side / 2**z)).astype(np.int64)
+        if len(cells) == 0 or np.unique(cells, axis=0, return_counts=True)[1].max() <= max_buildings:
+            return z
+    return MAX_LEVELS - 1
+
+def write_tile_pyramid(directory, results, levels=None, max_buildings=256, road_fraction=0.25, pixels=256):
+    """
+    Writes the tile pyramid of citygen.generate_city results to directory
+    and returns the index. levels defaults to just enough for at most
+    max_buildings buildings per finest tile. Below the finest level, roads
+    on straight lines shorter than road_fraction of the tile side are
+    dropped and buildings are merged at the size of one of `pixels` pixels
+    across the tile. Level directories left in directory by an earlier
+    pyramid are removed first, so no stale tiles survive.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.isdigit() and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name))
+    store = BuildingStore.concatenate([result['Buildings'] for result in results])
+    packed = store.pack()
+    vertices = packed['vertices'].astype(np.float64)
+    offsets = packed['offsets']
+    segments = np.concatenate([result['Junctions'][result['Edges']] for result in results] + [np.empty((0, 2, 2))])
+    blob = np.repeat(np.arange(len(results)), [len(result['Edges']) for result in results])
+    points = np.vstack([vertices, segments.reshape(-1, 2)])
+    if len(points) == 0:
+        points = np.zeros((1, 2))
+    origin = points.min(axis=0)
+    side = max((points.max(axis=0) - origin).max(), 1.0) * (1 + 1e-9)
+    # per-building boxes straight from the packed vertices
+    starts = offsets[:-1]
+    building_boxes = np.empty((0, 4))
+    if len(starts):
+        building_boxes = np.c_[np.minimum.reduceat(vertices, starts), np.maximum.reduceat(vertices, starts)]
+    road_boxes = np.c_[segments.min(axis=1), segments.max(axis=1)]
+    line_lengths = road_line_lengths(segments, blob)
+    rings = [coords for _, coords in store]
+    footprints = None
+    if levels is None:
+        centres = (building_boxes[:, :2] + building_boxes[:, 2:]) / 2
+        levels = finest_level(centres, origin, side, max_buildings) + 1
+    index = {'origin': origin.tolist(), 'size': side, 'levels': levels, 'tiles': []}
+    for z in range(levels):
+        size = side / 2**z
+        buildings = group_by_tile(*tile_spans(building_boxes, origin, size))
+        finest = z == levels - 1
+        keep = np.ones(len(segments), dtype=bool) if finest else line_lengths >= road_fraction * size
+        roads = group_by_tile(*tile_spans(road_boxes[keep], origin, size))
+        road_ids = np.flatnonzero(keep)
+        if not finest and footprints is None:
+            footprints = shapely.polygons([np.asarray(ring) for ring in rings]) if rings else np.empty(0, dtype=object)
+        for x, y in sorted(set(buildings) | set(roads)):
+            members = buildings.get((x, y), np.empty(0, dtype=np.int64))
+            if finest:
+                tile_buildings = [[BUILDING_TYPES[packed['types'][k]], rings[k]] for k in members]
+            else:
+                tile_buildings = merge_buildings(packed['types'][members], footprints[members], size / pixels)
+            tile = {'bounds': [origin[0] + x*size, origin[1] + y*size, origin[0] + (x + 1)*size, origin[1] + (y + 1)*size],
+                    'buildings': tile_buildings,
+                    'roads': segments[road_ids[roads.get((x, y), [])]].tolist()}
+            path = os.path.join(directory, str(z), str(x))
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, f'{y}.json'), 'w') as f:
+                json.dump(tile, f)
+            index['tiles'].append(f'{z}/{x}/{y}')
+    with open(os.path.join(directory, 'tiles.json'), 'w') as f:
+        json.dump(index, f, indent=4)
+    return index
+
+if __name__ == '__main__':
+    from citygen import generate_city
+    from city_io import iter_city_shapes
+    from exclusions import ExclusionMask
+    parser = argparse.ArgumentParser(description='Generate a city and write it as a tile pyramid.')
+    parser.add_argument('source')
+    parser.add_argument('directory')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--levels', type=int, default=None)
+    args = parser.parse_args()
+    blobData = {"cityShapes": list(iter_city_shapes(args.source))}
+    results = generate_city(blobData, seed=args.seed, exclusions=ExclusionMask.from_city(blobData))
+    index = write_tile_pyramid(args.directory, results, args.levels)
+    print(f"{len(index['tiles'])} tiles over {index['levels']} levels written to {args.directory}")